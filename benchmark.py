@@ -0,0 +1,156 @@
+from typing import Callable
+from game import Game, SubgameView, VertId, export_to_file, parse_game, solution_domain
+from generators import GENERATORS
+from pruning import prune
+from sdsi import SDSI
+from sdsi_bidirectional import SDSI_bidirectional
+from sdsi_reverse import SDSI_reverse
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# vertex counts every generator is run at, the clique sizes are kept small because of its edges.
+# On ladder games the reach stays pruned for many layers, a pruner that starts over on every
+# layer is quadratic there, so they run at full size to catch that
+SIZES = {'random': [1000, 10000, 100000], 'ladder': [1000, 10000, 100000], 'clique': [50, 200, 500], 'chain': [100, 1000, 5000]}
+# the local search drivers solve a lot of subgames, they only run on the smallest games
+LOCAL_SEARCH_LIMIT = 300
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# every benchmark is (setup, timed, largest game): setup(game) prepares an argument outside of
+# the timing, timed(game, path, scratch, argument) is what gets timed
+
+def no_setup(game: Game) -> None:
+    return None
+
+def time_parse(game: Game, path: str, scratch: str, _) -> None:
+    parse_game(path)
+
+def time_prune(game: Game, path: str, scratch: str, vertices: set[VertId]) -> None:
+    prune(game, vertices, game.init)
+
+def time_layers(algo_to_use) -> Callable:
+    def timed(game: Game, path: str, scratch: str, _) -> None:
+        algo = algo_to_use(game, VertId(0))
+        while algo.increase_reach(1):
+            algo.prune_subset_optimized()
+    return timed
+
+def first_moves(game: Game) -> dict[VertId, VertId]:
+    return {v: game.successors(v)[0] for v in game.vertices if game.owner[v] == 0 and len(game.successors(v)) != 0}
+
+def time_domain(game: Game, path: str, scratch: str, strategy: dict[VertId, VertId]) -> None:
+    solution_domain(game, strategy)
+
+def even_vertices(game: Game) -> set[VertId]:
+    return set(range(0, len(game), 2))
+
+def time_export(game: Game, path: str, scratch: str, vertices: set[VertId]) -> None:
+    export_to_file(SubgameView(game, vertices), os.path.join(scratch, "export.pg"))
+
+def time_local_search(*options: str) -> Callable:
+    # the driver is a script, it is timed as a whole with the in-process solver standing in for oink
+    def timed(game: Game, path: str, scratch: str, _) -> None:
+        subprocess.run([sys.executable, os.path.join(HERE, "kraam_local_optimum.py"), path, os.path.join(scratch, "local.pg"),
+                        "-solver", "zielonka", "-nocache", *options], stdout=subprocess.DEVNULL, check=True)
+    return timed
+
+BENCHMARKS: dict[str, tuple[Callable, Callable, int | None]] = {
+    'parse': (no_setup, time_parse, None),
+    'prune': (lambda game: set(game.vertices), time_prune, None),
+    'sdsi': (no_setup, time_layers(SDSI), None),
+    'sdsi-bi': (no_setup, time_layers(SDSI_bidirectional), None),
+    'sdsi-rev': (no_setup, time_layers(SDSI_reverse), None),
+    'solution-domain': (first_moves, time_domain, None),
+    'export': (even_vertices, time_export, None),
+    'local': (no_setup, time_local_search(), LOCAL_SEARCH_LIMIT),
+    'local-sda': (no_setup, time_local_search("-sda"), LOCAL_SEARCH_LIMIT),
+}
+
+
+def run_suite(names: list[str], generators: list[str], maxSize: int | None, repeat: int, seed: int) -> dict[str, float]:
+    """
+    Times every benchmark on every generated game, the best of repeat runs counts.
+    Keys are benchmark/generator/vertices.
+    """
+    results: dict[str, float] = dict()
+    with tempfile.TemporaryDirectory(prefix="kraam_bench_") as scratch:
+        for generator in generators:
+            for size in SIZES[generator]:
+                if maxSize is not None and size > maxSize:
+                    continue
+                # the ladder generator counts rungs of two vertices
+                game = GENERATORS[generator](size // 2 if generator == 'ladder' else size, seed)
+                path = os.path.join(scratch, generator + str(size) + ".pg")
+                export_to_file(game, path)
+                for name in names:
+                    (setup, fn, limit) = BENCHMARKS[name]
+                    if limit is not None and len(game) > limit:
+                        continue
+                    argument = setup(game)
+                    best = float('inf')
+                    for _ in range(repeat):
+                        startTime = time.perf_counter()
+                        fn(game, path, scratch, argument)
+                        best = min(best, time.perf_counter() - startTime)
+                    key = name + "/" + generator + "/" + str(len(game))
+                    results[key] = best
+                    print(f"{key:32} {best:9.4f}s", flush=True)
+    return results
+
+def compare(results: dict[str, float], baseline: dict[str, float], threshold: float, floor: float) -> list[str]:
+    """
+    Returns the keys that got slower than the baseline by more than threshold (a fraction).
+    Timings below floor seconds are too noisy to judge.
+    """
+    regressions = []
+    for (key, seconds) in results.items():
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        ratio = seconds / base if base > 0 else float('inf')
+        slower = ratio > 1 + threshold and max(seconds, base) >= floor
+        if slower:
+            regressions.append(key)
+        print(f"{key:32} {base:9.4f}s -> {seconds:9.4f}s  x{ratio:5.2f}" + ("  REGRESSION" if slower else ""))
+    return regressions
+
+
+def main_func():
+    results = run_suite(args.benchmarks, args.generators, args.max, args.repeat, args.seed)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "seed": args.seed, "results": results}, file, indent=1)
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold, args.floor)
+        if len(regressions) != 0:
+            print(str(len(regressions)) + " regression(s) beyond " + f"{args.threshold:.0%}")
+            sys.exit(1)
+
+
+parser = argparse.ArgumentParser(
+    prog='benchmark',
+    description='Times the kraam hot paths on seeded synthetic games and compares them to a baseline.'
+)
+parser.add_argument('-o', '--output', help='write the timings to this JSON file, to be used as a baseline later')
+parser.add_argument('-b', '--baseline', help='JSON file written by an earlier run to compare against')
+parser.add_argument('-t', '--threshold', type=float, default=0.2, help='allowed slowdown as a fraction, 0.2 is 20%%')
+parser.add_argument('-floor', '--floor', type=float, default=0.01, help='timings below this many seconds are never flagged')
+parser.add_argument('-bench', '--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+parser.add_argument('-gen', '--generators', nargs='+', choices=list(GENERATORS), default=list(GENERATORS))
+parser.add_argument('-max', '--max', type=int, help='skip games with more vertices')
+parser.add_argument('-r', '--repeat', type=int, default=3)
+parser.add_argument('-seed', '--seed', type=int, default=0)
+
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    main_func()
@@ -0,0 +1,256 @@
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Iterable
+from game import Game, VertId, ID_TYPE
+from solver import Solution, SolverBackend
+from metrics import count
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "kraam", "solutions.sqlite")
+# writes are buffered and flushed in batches, a commit syncs the file and costs more than the insert
+COMMIT_EVERY = 64
+# a slow run still flushes its buffer this often, so other processes see the new entries
+FLUSH_SECONDS = 5.0
+# how long a write waits for another process to release the file
+BUSY_TIMEOUT = 2.0
+
+
+def game_hash(game: Game) -> bytes:
+    """
+    Fingerprint of the content of a game, independent of how it was parsed.
+    """
+    digest = hashlib.sha256()
+    vertices = game.vertices if isinstance(game.vertices, range) else sorted(game.vertices)
+    for part in (array(ID_TYPE, vertices), array(ID_TYPE, [game.init]), game.priority, game.owner, game.outStart, game.outTargets):
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part.tobytes())
+    return digest.digest()
+
+def subgame_key(parentHash: bytes, cVertices: Iterable[VertId], namespace: str = "") -> bytes:
+    """
+    Canonical key of a subgame: the parent fingerprint and the sorted vertex ids.
+    The namespace separates solvers that may pick different strategies.
+    """
+    digest = hashlib.sha256(parentHash)
+    digest.update(namespace.encode())
+    digest.update(array(ID_TYPE, sorted(cVertices)).tobytes())
+    return digest.digest()
+
+
+def encode_solution(solution: Solution) -> bytes:
+    parts = (array(ID_TYPE, sorted(solution.won[0])), array(ID_TYPE, sorted(solution.won[1])),
+             array(ID_TYPE, solution.strategy.keys()), array(ID_TYPE, solution.strategy.values()))
+    header = array('q', [solution.winner] + [len(part) for part in parts])
+    return zlib.compress(header.tobytes() + b''.join(part.tobytes() for part in parts))
+
+def decode_solution(game: Game, data: bytes) -> Solution:
+    data = zlib.decompress(data)
+    header = array('q')
+    header.frombytes(data[:5 * header.itemsize])
+    offset = len(header) * header.itemsize
+    parts = []
+    for length in header[1:]:
+        part = array(ID_TYPE)
+        part.frombytes(data[offset:offset + length * part.itemsize])
+        offset += length * part.itemsize
+        parts.append(part)
+    return Solution(game, header[0], (set(parts[0]), set(parts[1])), dict(zip(parts[2], parts[3])))
+
+
+class SolutionCache:
+    """
+    Two tier cache of solved subgames: an in-memory LRU of decoded solutions in front of
+    an SQLite file of encoded ones. The file is kept below maxBytes by evicting the least
+    recently used entries. New entries and use times are buffered in memory and written in
+    one short transaction per batch and on close, so the file is never locked between
+    batches and several processes can share it; a run that is killed loses at most the
+    last batch. If the file stays locked the cache goes on in memory only. Safe to use
+    from the threads of a backend.
+    """
+    def __init__(self, path: str | None = DEFAULT_CACHE_PATH, memoryEntries: int = 1024, maxBytes: int = 256 * 2**20):
+        self.memory: OrderedDict[bytes, Solution] = OrderedDict()
+        self.memoryEntries = memoryEntries
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.memoryHits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.db: sqlite3.Connection | None = None
+        self.size = 0
+        self.pending: dict[bytes, tuple[bytes, float]] = dict()
+        self.used: dict[bytes, float] = dict()
+        self.flushed = time.monotonic()
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+            # readers do not block the writer and the other way round
+            self.db.execute("PRAGMA journal_mode=WAL")
+            with self.db:
+                self.db.execute("CREATE TABLE IF NOT EXISTS solutions (key BLOB PRIMARY KEY, value BLOB, used REAL)")
+            self.size = self.db.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM solutions").fetchone()[0]
+
+    def remember(self, key: bytes, solution: Solution) -> None:
+        self.memory[key] = solution
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memoryEntries:
+            self.memory.popitem(last=False)
+
+    def get(self, game: Game, key: bytes) -> Solution | None:
+        with self.lock:
+            solution = self.memory.get(key)
+            if solution is not None:
+                self.memory.move_to_end(key)
+                self.memoryHits += 1
+                return solution
+            if self.db is not None:
+                row = self.pending.get(key)
+                if row is None:
+                    row = self.read(key, "SELECT value FROM solutions WHERE key = ?")
+                if row is not None:
+                    self.used[key] = time.time()
+                    solution = decode_solution(game, row[0])
+                    self.remember(key, solution)
+                    self.diskHits += 1
+                    return solution
+            self.misses += 1
+            return None
+
+    def put(self, key: bytes, solution: Solution) -> None:
+        with self.lock:
+            self.remember(key, solution)
+            if self.db is None:
+                return
+            value = encode_solution(solution)
+            if len(value) > self.maxBytes:
+                return
+            # a replaced row no longer counts towards the size
+            row = self.pending.get(key)
+            if row is None:
+                row = self.read(key, "SELECT LENGTH(value) FROM solutions WHERE key = ?")
+            else:
+                row = (len(row[0]),)
+            if row is not None:
+                self.size -= row[0]
+            self.pending[key] = (value, time.time())
+            self.used.pop(key, None)
+            self.size += len(value)
+            if self.size > self.maxBytes:
+                self.evict()
+            elif len(self.pending) + len(self.used) >= COMMIT_EVERY or time.monotonic() - self.flushed >= FLUSH_SECONDS:
+                self.flush()
+
+    def read(self, key: bytes, query: str) -> tuple | None:
+        try:
+            return self.db.execute(query, (key,)).fetchone()
+        except sqlite3.OperationalError:
+            self.disable()
+            return None
+
+    def flush(self) -> None:
+        """
+        Writes the buffered entries and use times in one transaction.
+        """
+        try:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)",
+                                    [(key, value, used) for (key, (value, used)) in self.pending.items()])
+                self.db.executemany("UPDATE solutions SET used = ? WHERE key = ?",
+                                    [(used, key) for (key, used) in self.used.items()])
+        except sqlite3.OperationalError:
+            self.disable()
+            return
+        self.pending.clear()
+        self.used.clear()
+        self.flushed = time.monotonic()
+
+    def evict(self) -> None:
+        # drop the least recently used quarter of the budget at once, so inserts stay cheap
+        self.flush()
+        if self.db is None:
+            return
+        target = self.maxBytes * 3 // 4
+        try:
+            with self.db:
+                rows = self.db.execute("SELECT key, LENGTH(value) FROM solutions ORDER BY used").fetchall()
+                removed = []
+                for (key, length) in rows:
+                    if self.size <= target:
+                        break
+                    removed.append((key,))
+                    self.size -= length
+                self.db.executemany("DELETE FROM solutions WHERE key = ?", removed)
+        except sqlite3.OperationalError:
+            self.disable()
+
+    def disable(self) -> None:
+        # the file stays locked by another process or broke, the memory tier goes on alone
+        count("cache disk errors")
+        self.db.close()
+        self.db = None
+        self.pending.clear()
+        self.used.clear()
+
+    def stats(self) -> str:
+        return ("cache: " + str(self.memoryHits + self.diskHits) + " hits (" + str(self.memoryHits) + " memory, "
+                + str(self.diskHits) + " disk), " + str(self.misses) + " misses")
+
+    def close(self) -> None:
+        with self.lock:
+            if self.db is not None:
+                self.flush()
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+
+class CachedBackend(SolverBackend):
+    """
+    Looks every subgame up in a SolutionCache before handing it to the wrapped backend,
+    new solutions are stored as soon as they are done.
+    """
+    def __init__(self, backend: SolverBackend, cache: SolutionCache, namespace: str = ""):
+        self.backend = backend
+        self.cache = cache
+        self.namespace = namespace
+        self.jobs = backend.jobs
+        self.hashes: dict[int, tuple[Game, bytes]] = dict()
+
+    def key(self, game: Game, cVertices: Iterable[VertId]) -> bytes:
+        known = self.hashes.get(id(game))
+        if known is None or known[0] is not game:
+            known = (game, game_hash(game))
+            self.hashes[id(game)] = known
+        return subgame_key(known[1], cVertices, self.namespace)
+
+    def submit(self, game: Game, cVertices: Iterable[VertId]) -> 'Future[Solution]':
+        cVertices = set(cVertices)
+        key = self.key(game, cVertices)
+        solution = self.cache.get(game, key)
+        count("cache hits" if solution is not None else "cache misses")
+        if solution is not None:
+            future: Future[Solution] = Future()
+            future.set_result(solution)
+            return future
+        future = self.backend.submit(game, cVertices)
+        future.add_done_callback(lambda done: not done.cancelled() and done.exception() is None and self.cache.put(key, done.result()))
+        return future
+
+    def submit_task(self, fn: Callable[..., Any], game: Game, *args: Any) -> Future:
+        return self.backend.submit_task(fn, game, *args)
+
+    def close(self) -> None:
+        self.backend.close()
+        self.cache.close()
+
+
+def make_cached_backend(backend: SolverBackend, path: str | None, maxMegabytes: int = 256, namespace: str = "") -> CachedBackend:
+    """
+    Wraps backend in a cache, path None keeps the cache in memory only.
+    """
+    return CachedBackend(backend, SolutionCache(path, maxBytes=maxMegabytes * 2**20), namespace)
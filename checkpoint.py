@@ -0,0 +1,125 @@
+"""
+Checkpoints of a local search: every subgame found so far with its solution size and whether its
+neighbours were evaluated, so that a search that was stopped continues where it was.
+"""
+from array import array
+from game import BitSet, Game
+from cache import game_hash
+import hashlib
+import os
+import signal
+import sys
+import time
+import zlib
+
+MAGIC = b'kraamcp1'
+
+
+def encode_checkpoint(tag: bytes, width: int, perf: dict[BitSet, int], evaluated: set[BitSet]) -> bytes:
+    """
+    The subgames are stored as bitsets of width bytes, each one xored with the one before it.
+    They are kept in the order of perf, which breaks ties between equally good subgames in the
+    search. That order puts the neighbours of a subgame together, so the deltas are mostly zeros
+    and compress well.
+    """
+    keys = list(perf)
+    header = array('q', [width, len(keys)])
+    sizes = array('q', map(perf.__getitem__, keys))
+    flags = bytes(sg in evaluated for sg in keys)
+    previous = 0
+    deltas = []
+    for sg in keys:
+        deltas.append((sg.bits ^ previous).to_bytes(width, 'little'))
+        previous = sg.bits
+    return MAGIC + tag + zlib.compress(header.tobytes() + sizes.tobytes() + flags + b''.join(deltas))
+
+def decode_checkpoint(tag: bytes, data: bytes) -> tuple[dict[BitSet, int], set[BitSet]]:
+    if data[:len(MAGIC)] != MAGIC or data[len(MAGIC):len(MAGIC) + len(tag)] != tag:
+        raise ValueError("checkpoint of another game or search")
+    data = zlib.decompress(data[len(MAGIC) + len(tag):])
+    header = array('q')
+    header.frombytes(data[:2 * header.itemsize])
+    (width, n) = header
+    offset = len(header) * header.itemsize
+    sizes = array('q')
+    sizes.frombytes(data[offset:offset + n * sizes.itemsize])
+    offset += n * sizes.itemsize
+    flags = data[offset:offset + n]
+    offset += n
+    perf: dict[BitSet, int] = dict()
+    evaluated: set[BitSet] = set()
+    bits = 0
+    for i in range(n):
+        bits ^= int.from_bytes(data[offset + i * width:offset + (i + 1) * width], 'little')
+        sg = BitSet.from_bits(bits)
+        perf[sg] = sizes[i]
+        if flags[i]:
+            evaluated.add(sg)
+    return (perf, evaluated)
+
+
+def exit_on_signal(signum, frame):
+    # SIGTERM ends the process like SIGINT does, with an exception, so the checkpoint is written
+    sys.exit(128 + signum)
+
+class Checkpointer:
+    """
+    Keeps the checkpoint of a local search in path, for the state in perf and evaluated, which the
+    search updates in place. save_if_due writes it at most every interval seconds, leaving the with
+    block writes it too, also when the search is stopped by SIGTERM or SIGINT.
+    A checkpoint only resumes the same search (variant) on the same game. Without a path nothing is written.
+    """
+    __slots__ = ('path', 'tag', 'width', 'perf', 'evaluated', 'interval', 'last', 'previousHandler')
+
+    def __init__(self, path: str | None, game: Game, variant: str, perf: dict[BitSet, int], evaluated: set[BitSet],
+                 interval: float = 60):
+        self.path = path
+        self.tag = hashlib.sha256(game_hash(game) + variant.encode()).digest()
+        self.width = -(-game.num_ids() // 8)
+        self.perf = perf
+        self.evaluated = evaluated
+        self.interval = interval
+        self.last = time.monotonic()
+        self.previousHandler = None
+
+    def load(self) -> bool:
+        """
+        Fills perf and evaluated from the checkpoint, returns False if there is none to resume.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as file:
+            data = file.read()
+        try:
+            (perf, evaluated) = decode_checkpoint(self.tag, data)
+        except (ValueError, zlib.error) as e:
+            print("not resuming from " + self.path + ": " + str(e))
+            return False
+        self.perf.update(perf)
+        self.evaluated.update(evaluated)
+        print("resumed " + str(len(perf)) + " subgames, " + str(len(evaluated)) + " evaluated, from " + self.path)
+        return True
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        data = encode_checkpoint(self.tag, self.width, self.perf, self.evaluated)
+        # written next to the checkpoint and moved over it, a stopped write keeps the last one
+        with open(self.path + '.tmp', 'wb') as file:
+            file.write(data)
+        os.replace(self.path + '.tmp', self.path)
+        self.last = time.monotonic()
+
+    def save_if_due(self) -> None:
+        if time.monotonic() - self.last >= self.interval:
+            self.save()
+
+    def __enter__(self) -> 'Checkpointer':
+        if self.path is not None:
+            self.previousHandler = signal.signal(signal.SIGTERM, exit_on_signal)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.path is not None:
+            signal.signal(signal.SIGTERM, self.previousHandler)
+        self.save()
@@ -1,203 +1,859 @@
-from operator import contains
-from typing import TypeAlias
+from array import array
+from collections import deque
+from itertools import accumulate, chain, compress, islice, repeat
+from operator import add, eq, sub
+from typing import AbstractSet, Iterable, Iterator, Sequence, TypeAlias
 from typing import NewType
-import sys
+from metrics import timed
+import bz2
+import gzip
+import lzma
+import re
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 VertId = NewType('VertId', int)
 Priority = NewType('Priority', int)
-Game: TypeAlias = tuple[set[VertId], VertId, dict[VertId, Priority], set[VertId], dict[VertId, set[VertId]], dict[VertId, set[VertId]]]
-
-def parse_game(filename: str, initVert: VertId = VertId(0)) -> Game:
-    file = open(filename, 'r')
-    num_vertices = int(file.readline().strip("\n\r; parity"))
-    vertices = set(map(VertId, range(num_vertices)))
-    priority : dict[VertId, Priority] = dict()
-    owned : set[VertId] = set()
-    outEdges : dict[VertId, set[VertId]] = dict()
-    incEdges : dict[VertId, set[VertId]] = dict()
-    
-    for i in range(num_vertices):
-        outEdges[VertId(i)] = set()
-        incEdges[VertId(i)] = set()
-    
-    for i in range(num_vertices):
-        line = file.readline()
-        line = line.strip("\n\r;")
-        splitline = line.split()
-        id : VertId = VertId(int(splitline[0]))
-        priority[id] = Priority(int(splitline[1]))
-        if (splitline[2] == "0"):
-            owned.add(id)
-        
-        outEdges[id] = set(map(VertId, map(int, splitline[3].split(','))))
-        for otherId in outEdges[id]:
-            incEdges[otherId].add(id)
-        
-        if len(splitline) == 5 and splitline[4] == "initial":
-            initVert = id
-            
-    file.close()
-    return (vertices, initVert, priority, owned, outEdges, incEdges)
-    
-def is_valid_subgame(parent: Game, cVertices: set[VertId]) -> bool:
-    (pVertices, pInit, pPriority, pOwned, pOutEdges, pIncEdges) = parent
-    
+# the old tuple form of a game, only used by the compatibility adapter
+GameTuple: TypeAlias = tuple[set[VertId], VertId, dict[VertId, Priority], set[VertId], dict[VertId, set[VertId]], dict[VertId, set[VertId]]]
+
+# typecodes of the arrays backing a game
+ID_TYPE = 'i'
+OFFSET_TYPE = 'q'
+PRIORITY_TYPE = 'q'
+OWNER_TYPE = 'b'
+
+
+class Game:
+    """
+    Compact array-backed parity game.
+    priority and owner are indexed by vertex id, edges are stored in CSR form:
+    the successors of v are outTargets[outStart[v]:outStart[v + 1]], the predecessors
+    are incTargets[incStart[v]:incStart[v + 1]].
+    Ids that are not in vertices (e.g. in a realised subgame) have no edges.
+    """
+    __slots__ = ('vertices', 'init', 'priority', 'owner', 'outStart', 'outTargets', 'incStart', 'incTargets')
+
+    def __init__(self, vertices: range | frozenset[VertId], init: VertId, priority: array, owner: array,
+                 outStart: array, outTargets: array, incStart: array, incTargets: array):
+        self.vertices = vertices
+        self.init = init
+        self.priority = priority
+        self.owner = owner
+        self.outStart = outStart
+        self.outTargets = outTargets
+        self.incStart = incStart
+        self.incTargets = incTargets
+
+    def __len__(self) -> int:
+        return len(self.vertices)
+
+    def num_ids(self) -> int:
+        return len(self.priority)
+
+    def successors(self, v: VertId) -> array:
+        return self.outTargets[self.outStart[v]:self.outStart[v + 1]]
+
+    def predecessors(self, v: VertId) -> array:
+        return self.incTargets[self.incStart[v]:self.incStart[v + 1]]
+
+    def is_owned(self, v: VertId) -> bool:
+        return self.owner[v] == 0
+
+    def to_tuple(self) -> GameTuple:
+        vertices = set(self.vertices)
+        priority = {v: Priority(self.priority[v]) for v in vertices}
+        owned = {v for v in vertices if self.owner[v] == 0}
+        outEdges = {v: set(self.successors(v)) for v in vertices}
+        incEdges = {v: set(self.predecessors(v)) for v in vertices}
+        return (vertices, self.init, priority, owned, outEdges, incEdges)
+
+    @staticmethod
+    def from_tuple(game: GameTuple) -> 'Game':
+        (vertices, init, priority, owned, outEdges, incEdges) = game
+        numIds = max(vertices) + 1 if len(vertices) != 0 else 0
+        prio = array(PRIORITY_TYPE, bytes(numIds * array(PRIORITY_TYPE).itemsize))
+        owner = array(OWNER_TYPE, b'\x01' * numIds)
+        for v in vertices:
+            prio[v] = priority[v]
+            if v in owned:
+                owner[v] = 0
+        if vertices == set(range(numIds)):
+            vertices = range(numIds)
+        return build_game(vertices, init, prio, owner, {v: sorted(outEdges[v]) for v in vertices})
+
+
+def as_game(game: Game | GameTuple) -> Game:
+    return game if isinstance(game, Game) else Game.from_tuple(game)
+
+def with_init(game: Game, init: VertId) -> Game:
+    """
+    The same game with init as the initial vertex, the arrays are shared and not copied.
+    """
+    if init not in game.vertices:
+        raise ValueError("initial vertex " + str(init) + " is not a vertex of the game")
+    return Game(game.vertices, init, game.priority, game.owner, game.outStart, game.outTargets, game.incStart, game.incTargets)
+
+
+# the positions of the set bits of every byte value
+BYTE_BITS = tuple(tuple(i for i in range(8) if b >> i & 1) for b in range(256))
+
+
+class BitSet:
+    """
+    Immutable set of vertex ids stored as the bits of a Python int, bit v is set when v is a member.
+    Union, intersection, difference and len are single int operations and a set takes one bit
+    per id of the parent game, which makes it a compact key for visited subgames.
+    Membership tests shift the whole int, for many lookups iterate it into a set first (see members).
+    """
+    __slots__ = ('bits',)
+
+    def __init__(self, vertices: Iterable[VertId] = ()):
+        if isinstance(vertices, BitSet):
+            self.bits: int = vertices.bits
+            return
+        ids = vertices if isinstance(vertices, (set, frozenset, list, range)) else list(vertices)
+        if len(ids) == 0:
+            self.bits = 0
+            return
+        data = bytearray(max(ids) // 8 + 1)
+        for v in ids:
+            data[v >> 3] |= 1 << (v & 7)
+        self.bits = int.from_bytes(data, 'little')
+
+    @staticmethod
+    def from_bits(bits: int) -> 'BitSet':
+        bitset = BitSet()
+        bitset.bits = bits
+        return bitset
+
+    def __len__(self) -> int:
+        return self.bits.bit_count()
+
+    def __bool__(self) -> bool:
+        return self.bits != 0
+
+    def __iter__(self) -> Iterator[VertId]:
+        data = self.bits.to_bytes((self.bits.bit_length() + 7) // 8, 'little')
+        for (i, byte) in enumerate(data):
+            if byte != 0:
+                for bit in BYTE_BITS[byte]:
+                    yield VertId(i * 8 + bit)
+
+    def __contains__(self, v: object) -> bool:
+        return isinstance(v, int) and v >= 0 and (self.bits >> v) & 1 == 1
+
+    def __or__(self, other: Iterable[VertId]) -> 'BitSet':
+        return BitSet.from_bits(self.bits | BitSet(other).bits)
+
+    def __and__(self, other: Iterable[VertId]) -> 'BitSet':
+        return BitSet.from_bits(self.bits & BitSet(other).bits)
+
+    def __sub__(self, other: Iterable[VertId]) -> 'BitSet':
+        return BitSet.from_bits(self.bits & ~BitSet(other).bits)
+
+    def __xor__(self, other: Iterable[VertId]) -> 'BitSet':
+        return BitSet.from_bits(self.bits ^ BitSet(other).bits)
+
+    def __le__(self, other: 'BitSet') -> bool:
+        return self.bits & ~other.bits == 0
+
+    def __ge__(self, other: 'BitSet') -> bool:
+        return other <= self
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, BitSet) and self.bits == other.bits
+
+    def __hash__(self) -> int:
+        return hash(self.bits)
+
+    def __repr__(self) -> str:
+        return "BitSet(" + str(set(self)) + ")"
+
+    def with_vertex(self, v: VertId) -> 'BitSet':
+        return BitSet.from_bits(self.bits | 1 << v)
+
+    def without_vertex(self, v: VertId) -> 'BitSet':
+        return BitSet.from_bits(self.bits & ~(1 << v))
+
+
+VertexSet: TypeAlias = set[VertId] | frozenset[VertId] | BitSet
+
+def members(vertices: VertexSet) -> AbstractSet[VertId]:
+    """
+    The vertices as a hash set, for code that tests membership a lot.
+    """
+    return set(vertices) if isinstance(vertices, BitSet) else vertices
+
+
+def build_game(vertices: range | Iterable[VertId], init: VertId, priority: array, owner: array,
+               outEdges: dict[VertId, Iterable[VertId]] | list[Iterable[VertId]]) -> Game:
+    """
+    Builds the CSR edge arrays from per-vertex successor lists, indexed by vertex id.
+    The priority and owner arrays determine the size of the id space.
+    """
+    numIds = len(priority)
+    if not isinstance(vertices, range):
+        vertices = frozenset(vertices)
+    outDegree = array(OFFSET_TYPE, bytes((numIds + 1) * array(OFFSET_TYPE).itemsize))
+    outTargets = array(ID_TYPE)
+    for v in sorted(vertices) if not isinstance(vertices, range) else vertices:
+        before = len(outTargets)
+        outTargets.extend(outEdges[v])
+        outDegree[v + 1] = len(outTargets) - before
+
+    return csr_game(vertices, init, priority, owner, array(OFFSET_TYPE, accumulate(outDegree)), outTargets)
+
+
+def csr_game(vertices: range | frozenset[VertId], init: VertId, priority: array, owner: array,
+             outStart: array, outTargets: array) -> Game:
+    """
+    Builds a game from its outgoing CSR arrays, the incoming edges are derived with a
+    counting sort of the edges on their destination, which keeps the sources in order.
+    """
+    numIds = len(priority)
+    if np is not None:
+        targets = np.frombuffer(outTargets, dtype=ID_TYPE)
+        sources = np.repeat(np.arange(numIds, dtype=ID_TYPE), np.diff(np.frombuffer(outStart, dtype=OFFSET_TYPE)))
+        incDegree = np.bincount(targets, minlength=numIds)
+        incStart = array(OFFSET_TYPE, np.concatenate(([0], np.cumsum(incDegree))).astype(OFFSET_TYPE).tobytes())
+        incTargets = array(ID_TYPE, sources[np.argsort(targets, kind='stable')].tobytes())
+    else:
+        # one bucket per destination, the sources are appended in edge order
+        outDegree = map(sub, outStart[1:], outStart[:-1])
+        edgeSources = chain.from_iterable(map(repeat, range(numIds), outDegree))
+        buckets: list[list[VertId]] = [[] for _ in range(numIds)]
+        deque(map(list.append, map(buckets.__getitem__, outTargets), edgeSources), maxlen=0)
+        incTargets = array(ID_TYPE, chain.from_iterable(buckets))
+        incStart = array(OFFSET_TYPE, accumulate(map(len, buckets), initial=0))
+
+    return Game(vertices, init, priority, owner, outStart, outTargets, incStart, incTargets)
+
+
+def open_game_file(filename: str):
+    """
+    Opens a game or solution file for binary reading, gzip, bzip2 and xz compressed
+    files are recognised by their magic bytes.
+    """
+    with open(filename, 'rb') as file:
+        magic = file.read(6)
+    if magic.startswith(b'\x1f\x8b'):
+        return gzip.open(filename, 'rb')
+    if magic.startswith(b'BZh'):
+        return bz2.open(filename, 'rb')
+    if magic.startswith(b'\xfd7zXZ\x00'):
+        return lzma.open(filename, 'rb')
+    return open(filename, 'rb')
+
+def read_game_file(filename: str) -> bytes:
+    with open_game_file(filename) as file:
+        return file.read()
+
+
+# the name of a vertex, split on it leaves the text around the names and the names in turn
+NAME_PATTERN = re.compile(rb'"((?:[^"\\]|\\.)*)"')
+
+@timed("parse")
+def parse_game(filename: str, initVert: VertId = VertId(0), report: bool = False) -> Game:
+    """
+    Parses a PGSolver game in one pass over the whole (possibly compressed) file.
+    The header is not trusted for the number of vertices, all vertex specifications
+    in the file are read. The initial vertex is taken from a "start" line or from a
+    vertex named "initial", initVert is used otherwise.
+    """
+    startTime = time.perf_counter()
+    data = read_game_file(filename)
+
+    (header, _, body) = data.partition(b';')
+    headerTokens = header.split()
+    if len(headerTokens) != 2 or headerTokens[0] != b'parity':
+        raise ValueError(filename + ": not a parity game, header is " + repr(header))
+    (first, _, rest) = body.partition(b';')
+    if first.split()[:1] == [b'start']:
+        initVert = VertId(int(first.split()[1]))
+        body = rest
+
+    if b'"' in body:
+        # named vertices: the names are cut out, what is left are plain specifications
+        # names may contain semicolons, only escaped quotes need the pattern
+        parts = NAME_PATTERN.split(body) if b'\\' in body else body.split(b'"')
+        names = parts[1::2]
+        if b'initial' in names:
+            # the vertex id starts the specification right before its name
+            before = parts[2 * names.index(b'initial')]
+            initVert = VertId(int(before.rpartition(b';')[2].split()[0]))
+        body = b''.join(parts[0::2])
+    tokens = body.replace(b';', b' ').split()
+
+    if len(tokens) % 4 != 0:
+        raise ValueError(filename + ": malformed vertex specification")
+    ids = array(ID_TYPE, map(int, tokens[0::4]))
+    priorities = array(PRIORITY_TYPE, map(int, tokens[1::4]))
+    owners = array(OWNER_TYPE, map(int, tokens[2::4]))
+    edgeTokens = tokens[3::4]
+
+    if ids != array(ID_TYPE, range(len(ids))):
+        # bring the specifications in id order
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        priorities = array(PRIORITY_TYPE, map(priorities.__getitem__, order))
+        owners = array(OWNER_TYPE, map(owners.__getitem__, order))
+        edgeTokens = [edgeTokens[i] for i in order]
+        ids = array(ID_TYPE, map(ids.__getitem__, order))
+    if any(map(eq, ids[1:], ids[:-1])):
+        raise ValueError(filename + ": vertex specified more than once")
+    numIds = ids[-1] + 1 if len(ids) != 0 else 0
+    vertices: range | frozenset[VertId] = range(numIds) if len(ids) == numIds else frozenset(ids)
+
+    outDegree = array(OFFSET_TYPE, bytes((numIds + 1) * array(OFFSET_TYPE).itemsize))
+    if isinstance(vertices, range):
+        (priority, owner) = (priorities, owners)
+        outDegree[1:] = array(OFFSET_TYPE, map(add, map(bytes.count, edgeTokens, repeat(b',')), repeat(1)))
+    else:
+        priority = array(PRIORITY_TYPE, bytes(numIds * array(PRIORITY_TYPE).itemsize))
+        owner = array(OWNER_TYPE, b'\x01' * numIds)
+        for (i, v) in enumerate(ids):
+            priority[v] = priorities[i]
+            owner[v] = owners[i]
+            outDegree[v + 1] = edgeTokens[i].count(b',') + 1
+    outTargets = array(ID_TYPE, map(int, b','.join(edgeTokens).split(b',')))
+    if len(outTargets) != 0 and (min(outTargets) < 0 or max(outTargets) >= numIds
+                                 or not (isinstance(vertices, range) or all(map(vertices.__contains__, outTargets)))):
+        raise ValueError(filename + ": edge to a vertex that is not specified")
+
+    game = csr_game(vertices, initVert, priority, owner, array(OFFSET_TYPE, accumulate(outDegree)), outTargets)
+    if has_duplicate_edges(game):
+        game = without_duplicate_edges(game)
+
+    if report:
+        seconds = time.perf_counter() - startTime
+        print("parsed " + str(len(vertices)) + " vertices and " + str(len(outTargets)) + " edges ("
+              + str(len(data)) + " bytes) in " + f"{seconds:.3f}" + "s, "
+              + f"{len(data) / max(seconds, 1e-9) / 1e6:.1f}" + " MB/s")
+    return game
+
+def has_duplicate_edges(game: Game) -> bool:
+    """
+    The sources of the incoming edges of a vertex are in order, so an edge that is in the
+    game twice shows up as the same source twice in a row within one incoming range.
+    """
+    incTargets = game.incTargets
+    repeats = list(compress(range(1, len(incTargets)), map(eq, incTargets[1:], incTargets[:-1])))
+    if len(repeats) == 0:
+        return False
+    starts = set(game.incStart)
+    return any(i not in starts for i in repeats)
+
+def without_duplicate_edges(game: Game) -> Game:
+    """
+    The game with every edge once, successors keep their order.
+    """
+    outEdges = {v: dict.fromkeys(game.successors(v)) for v in game.vertices}
+    return build_game(game.vertices, game.init, game.priority, game.owner, outEdges)
+
+def is_valid_subgame(parent: Game, cVertices: VertexSet) -> bool:
+    (rule1breaks, rule2breaks) = find_problems(parent, cVertices)
     # check that there are no opponent vertices with externally outgoing edges
     # only consider vertices that are _not_ owned
-    oppVertices = {v for v in cVertices if v not in pOwned}
-    nextFromOppVerts = set()
-    for v in oppVertices:
-        nextFromOppVerts |= pOutEdges[v]
-    
-    extVertices = pVertices - cVertices
-    if len(nextFromOppVerts & extVertices) != 0:
+    reachedExtVerts = set().union(*rule1breaks.values())
+    if len(reachedExtVerts) != 0:
         print("These external vertices can be reached from the subgame:")
-        print(nextFromOppVerts & extVertices)
+        print(reachedExtVerts)
         return False
-    
+
     # check that each even vertex has at least one outgoing edge with a destination within the subgame
-    ownedVertices = {v for v in cVertices if v in pOwned}
-    for v in ownedVertices:
-        if len(pOutEdges[v] & cVertices) == 0:
-            print("Vertex " + str(v) + " has no internally outgoing edges.")
-            return False
-        
+    if len(rule2breaks) != 0:
+        print("Vertex " + str(min(rule2breaks)) + " has no internally outgoing edges.")
+        return False
+
     return True
-    
-    
-def find_problems(parent: Game, cVertices: set[VertId]) -> tuple[dict[VertId, set[VertId]], set[VertId]]:
-    (pVertices, pInit, pPriority, pOwned, pOutEdges, pIncEdges) = parent
-    
-    # check that there are no opponent vertices with externally outgoing edges
-    # only consider vertices that are _not_ owned
-    oppVertices = {v for v in cVertices if v not in pOwned}
-    
-    rule1breaks: dict[VertId, set[VertId]] = dict()
-    extVertices = pVertices - cVertices
-    for v in oppVertices:
-        reachableExtVerts = extVertices & pOutEdges[v]
-        if len(reachableExtVerts) != 0:
-            rule1breaks[v] = reachableExtVerts
-    
-    
-    # check rule 2 breaks
-    rule2breaks: set[VertId] = set()
-    ownedVertices = {v for v in cVertices if v in pOwned}
-    for v in ownedVertices:
-        if len(pOutEdges[v] & cVertices) == 0:
-            rule2breaks.add(v)
-            
-    return (rule1breaks, rule2breaks)
 
-def find_problems_on_specified_verts(parent: Game, cVertices: set[VertId], relevantVertices : set[VertId]) -> tuple[dict[VertId, set[VertId]], set[VertId]]:
-    (pVertices, pInit, pPriority, pOwned, pOutEdges, pIncEdges) = parent
-    
-    # check that there are no opponent vertices with externally outgoing edges
-    # only consider vertices that are _not_ owned
-    oppVertices = {v for v in cVertices if v not in pOwned and v in relevantVertices}
-    
+
+def find_problems(parent: Game, cVertices: VertexSet) -> tuple[dict[VertId, set[VertId]], set[VertId]]:
+    # a mask pass costs O(V+E) of the parent, it pays off once the subgame is a fair part of it
+    if len(cVertices) * MASK_FRACTION >= parent.num_ids():
+        return find_problems_masked(parent, membership_mask(parent, cVertices))
+    cVertices = members(cVertices)
+    return find_problems_on_specified_verts(parent, cVertices, cVertices)
+
+def find_problems_on_specified_verts(parent: Game, cVertices: VertexSet, relevantVertices : Iterable[VertId]) -> tuple[dict[VertId, set[VertId]], set[VertId]]:
+    cVertices = members(cVertices)
+    owner = parent.owner
+    outStart = parent.outStart
+    outTargets = parent.outTargets
+
     rule1breaks: dict[VertId, set[VertId]] = dict()
-    extVertices = pVertices - cVertices
-    for v in oppVertices:
-        reachableExtVerts = extVertices & pOutEdges[v]
-        if len(reachableExtVerts) != 0:
-            rule1breaks[v] = reachableExtVerts
-    
-    
-    # check rule 2 breaks
     rule2breaks: set[VertId] = set()
-    ownedVertices = {v for v in cVertices if v in pOwned and v in relevantVertices}
-    for v in ownedVertices:
-        if len(pOutEdges[v] & cVertices) == 0:
+    for v in relevantVertices:
+        if v not in cVertices:
+            continue
+        dests = outTargets[outStart[v]:outStart[v + 1]]
+        if owner[v] != 0:
+            # rule 1: opponent vertices may not have externally outgoing edges
+            reachableExtVerts = {w for w in dests if w not in cVertices}
+            if len(reachableExtVerts) != 0:
+                rule1breaks[v] = reachableExtVerts
+        elif not any(w in cVertices for w in dests):
+            # rule 2: owned vertices need at least one internally outgoing edge
             rule2breaks.add(v)
-            
+
     return (rule1breaks, rule2breaks)
 
+# find_problems uses a membership mask for subgames with at least 1/MASK_FRACTION of the parent ids
+MASK_FRACTION = 8
+
+def membership_mask(parent: Game, cVertices: VertexSet) -> bytearray:
+    """
+    One byte per id of parent, 1 for the vertices in cVertices.
+    """
+    if isinstance(cVertices, BitSet) and np is not None:
+        data = np.frombuffer(cVertices.bits.to_bytes(-(-parent.num_ids() // 8), 'little'), dtype=np.uint8)
+        return bytearray(np.unpackbits(data, count=parent.num_ids(), bitorder='little').tobytes())
+    mask = bytearray(parent.num_ids())
+    for v in cVertices:
+        mask[v] = 1
+    return mask
+
+def find_problems_masked(parent: Game, mask: bytearray) -> tuple[dict[VertId, set[VertId]], set[VertId]]:
+    """
+    find_problems for the subgame given by a membership mask, in bulk over the edge arrays:
+    the internal edges are counted per vertex with a prefix sum over the edges, which gives
+    rule 1 (fewer internal edges than edges) and rule 2 (no internal edges) at once.
+    Uses NumPy when it is installed.
+    """
+    outStart = parent.outStart
+    if np is not None:
+        member = np.frombuffer(mask, dtype=np.uint8).astype(bool)
+        start = np.frombuffer(outStart, dtype=OFFSET_TYPE)
+        internal = np.zeros(len(parent.outTargets) + 1, dtype=np.int64)
+        np.cumsum(member[np.frombuffer(parent.outTargets, dtype=ID_TYPE)], out=internal[1:])
+        counts = internal[start[1:]] - internal[start[:-1]]
+        owned = np.frombuffer(parent.owner, dtype=OWNER_TYPE) == 0
+        rule1 = np.flatnonzero(member & ~owned & (counts < np.diff(start))).tolist()
+        rule2 = np.flatnonzero(member & owned & (counts == 0)).tolist()
+    else:
+        internal = list(accumulate(map(mask.__getitem__, parent.outTargets), initial=0))
+        owner = parent.owner
+        rule1 = []
+        rule2 = []
+        for v in compress(range(len(mask)), mask):
+            count = internal[outStart[v + 1]] - internal[outStart[v]]
+            if owner[v] == 0:
+                if count == 0:
+                    rule2.append(v)
+            elif count < outStart[v + 1] - outStart[v]:
+                rule1.append(v)
+
+    rule1breaks = {VertId(v): {w for w in parent.successors(v) if not mask[w]} for v in rule1}
+    return (rule1breaks, set(map(VertId, rule2)))
+
 """
 Builds a new game object from a parent game and a list of vertices that should be included in the subgame
 DOES NOT CHECK IF THE REQUESTED SUBGAME IS VALID
 """
-def realise_subgame(game: Game, cVertices: set[VertId]) -> Game:
-    (pVertices, pInit, pPriority, pOwned, pOutEdges, pIncEdges) = game
-    cPriority = {id:p for (id,p) in pPriority.items() if id in cVertices}
-    cOwned = pOwned & cVertices
-    cOutEdges = {id:(dests & cVertices) for (id,dests) in pOutEdges.items() if id in cVertices}
-    cIncEdges = {id:(origs & cVertices) for (id,origs) in pIncEdges.items() if id in cVertices}
-    
-    return (cVertices, pInit, cPriority, cOwned, cOutEdges, cIncEdges)
+def realise_subgame(game: Game, cVertices: VertexSet) -> Game:
+    cVertices = members(cVertices)
+    # the priority and owner arrays are shared with the parent, they are never modified
+    cOutEdges = {v: [w for w in game.successors(v) if w in cVertices] for v in cVertices}
+    return build_game(cVertices, game.init, game.priority, game.owner, cOutEdges)
+
 
+def flat_order(vertices: Iterable[VertId], init: VertId) -> list[VertId]:
+    """
+    The vertices of a game in the order flatten_game numbers them: the initial vertex first.
+    """
+    order = sorted(vertices)
+    if init in order:
+        order.remove(init)
+        order.insert(0, init)
+    return order
 
 def flatten_game(game: Game) -> Game:
-    (oldVertices, oldInit, oldPriority, oldOwned, oldOutEdges, oldIncEdges) = game
-    
-    # map old to new vertices (special case if initial vertex is 0)
-    i = 0
-    mapping : dict[VertId, VertId] = dict()
-    if oldInit == VertId(0):
-        mapping[VertId(0)] = VertId(0)
-        i = 1
-        for oldv in oldVertices:
-            if oldv != VertId(0):
-                mapping[oldv] = VertId(i)
-                i += 1
+    order = flat_order(game.vertices, game.init)
+    mapping : dict[VertId, VertId] = {old: VertId(new) for (new, old) in enumerate(order)}
+
+    newPriority = array(PRIORITY_TYPE, (game.priority[old] for old in order))
+    newOwner = array(OWNER_TYPE, (game.owner[old] for old in order))
+    newOutEdges = [[mapping[dest] for dest in game.successors(old)] for old in order]
+
+    return build_game(range(len(order)), VertId(0), newPriority, newOwner, newOutEdges)
+
+def compress_priorities(game: Game, cVertices: Iterable[VertId]) -> dict[VertId, int]:
+    """
+    Maps the vertices to the smallest priorities with the same order and parity,
+    this keeps the depth of zielonka at the number of parity alternations.
+    """
+    priority = game.priority
+    ranks: dict[int, int] = dict()
+    rank = -1
+    for p in sorted({priority[v] for v in cVertices}):
+        if rank < 0:
+            rank = p % 2
+        elif rank % 2 != p % 2:
+            rank += 1
+        ranks[p] = rank
+    return {v: ranks[priority[v]] for v in cVertices}
+
+def reachable(game: Game, start: VertId, cVertices: VertexSet | None = None) -> set[VertId]:
+    """
+    The vertices reachable from start, over the edges within cVertices if it is given.
+    """
+    seen = {start}
+    stack = [start]
+    while len(stack) != 0:
+        v = stack.pop()
+        for w in game.successors(v):
+            if w not in seen and (cVertices is None or w in cVertices):
+                seen.add(w)
+                stack.append(w)
+    return seen
+
+def strongly_connected_components(game: Game, cVertices: VertexSet) -> list[list[VertId]]:
+    """
+    Tarjan's algorithm with an explicit stack on the graph induced by cVertices. The components
+    come out in reverse topological order: a component only has edges into earlier ones.
+    """
+    cVertices = members(cVertices)
+    index: dict[VertId, int] = dict()
+    low: dict[VertId, int] = dict()
+    stack: list[VertId] = []
+    onStack: set[VertId] = set()
+    components: list[list[VertId]] = []
+    for root in sorted(cVertices):
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        onStack.add(root)
+        work = [(root, iter(game.successors(root)))]
+        while len(work) != 0:
+            (v, dests) = work[-1]
+            for w in dests:
+                if w not in cVertices:
+                    continue
+                if w not in index:
+                    index[w] = low[w] = len(index)
+                    stack.append(w)
+                    onStack.add(w)
+                    work.append((w, iter(game.successors(w))))
+                    break
+                if w in onStack:
+                    low[v] = min(low[v], index[w])
+            else:
+                # every successor of v is done
+                work.pop()
+                if len(work) != 0:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[v])
+                if low[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        onStack.discard(w)
+                        component.append(w)
+                        if w == v:
+                            break
+                    components.append(component)
+    return components
+
+def losing_region(game: Game, cVertices: set[VertId]) -> set[VertId]:
+    """
+    Vertices of the subgame cVertices that player 0 trivially loses, with the attractor of player 1
+    to them: dead ends of player 0, player 1 vertices with an odd self loop and components without
+    outgoing edges that only have odd priorities. cVertices must be closed under successors.
+    """
+    owner = game.owner
+    priority = game.priority
+    lost: set[VertId] = set()
+    for v in cVertices:
+        dests = game.successors(v)
+        if owner[v] == 0 and len(dests) == 0:
+            lost.add(v)
+        elif owner[v] == 1 and priority[v] % 2 == 1 and v in dests:
+            lost.add(v)
+    for component in strongly_connected_components(game, cVertices):
+        inside = set(component)
+        if all(priority[v] % 2 == 1 and len(game.successors(v)) != 0 and all(w in inside for w in game.successors(v))
+               for v in component) and (len(component) > 1 or component[0] in game.successors(component[0])):
+            lost.update(component)
+
+    # player 1 attracts its own vertices with one edge into the region, those of player 0 with all of them
+    queue = list(lost)
+    escapes: dict[VertId, int] = dict()
+    while len(queue) != 0:
+        w = queue.pop()
+        for v in game.predecessors(w):
+            if v in lost or v not in cVertices:
+                continue
+            if owner[v] == 0:
+                count = escapes.get(v, len(game.successors(v))) - 1
+                if count > 0:
+                    escapes[v] = count
+                    continue
+            lost.add(v)
+            queue.append(v)
+    return lost
+
+def reduce_game(game: Game) -> tuple[Game, list[VertId]]:
+    """
+    Cuts a game down before a search: only the vertices reachable from the initial vertex stay,
+    without the region player 0 trivially loses (unless the initial vertex is in it), and the
+    priorities are compressed. Every subgame player 0 wins keeps its solution domain in the result.
+    Returns the reduced game, numbered like flatten_game, and order: order[i] is the id in game of vertex i.
+    """
+    keep = reachable(game, game.init)
+    lost = losing_region(game, keep)
+    if game.init not in lost:
+        keep = reachable(game, game.init, keep - lost)
+
+    order = flat_order(keep, game.init)
+    mapping = {old: VertId(new) for (new, old) in enumerate(order)}
+    ranks = compress_priorities(game, keep)
+    newPriority = array(PRIORITY_TYPE, (ranks[old] for old in order))
+    newOwner = array(OWNER_TYPE, (game.owner[old] for old in order))
+    newOutEdges = [[mapping[dest] for dest in game.successors(old) if dest in mapping] for old in order]
+    return (build_game(range(len(order)), VertId(0), newPriority, newOwner, newOutEdges), order)
+
+def search_game(game: Game, reduce: bool) -> tuple[Game, list[VertId] | None]:
+    """
+    The game a search runs on: game itself, or with reduce the reduced game and its order,
+    which maps the vertices of the result back to game.
+    """
+    if not reduce:
+        return (game, None)
+    (reduced, order) = reduce_game(game)
+    print("reduced to " + str(len(reduced)) + " of " + str(len(game)) + " vertices")
+    return (reduced, order)
+
+
+class SubgameView:
+    """
+    The subgame of parent induced by cVertices (a vertex set or a membership mask), numbered
+    like flatten_game numbers it (the initial vertex first), without copying the parent.
+    Successors are filtered and renumbered when they are asked for, so a view of a vertex set
+    costs time in the size of the subgame, not of the parent.
+    order[i] is the parent id of vertex i of the view.
+    """
+    __slots__ = ('parent', 'members', 'order', 'index')
+
+    def __init__(self, parent: Game, cVertices: VertexSet | bytearray):
+        self.parent = parent
+        if isinstance(cVertices, (bytes, bytearray)):
+            # a membership mask like membership_mask makes
+            cVertices = set(map(VertId, compress(range(len(cVertices)), cVertices)))
+        self.members: AbstractSet[VertId] = members(cVertices)
+        self.order = flat_order(self.members, parent.init)
+        self.index: dict[VertId, VertId] = {old: VertId(new) for (new, old) in enumerate(self.order)}
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    @property
+    def vertices(self) -> range:
+        return range(len(self.order))
+
+    @property
+    def init(self) -> VertId:
+        return VertId(0)
+
+    def successors(self, v: VertId) -> list[VertId]:
+        index = self.index
+        return [index[w] for w in self.parent.successors(self.order[v]) if w in index]
+
+    def predecessors(self, v: VertId) -> list[VertId]:
+        index = self.index
+        return [index[w] for w in self.parent.predecessors(self.order[v]) if w in index]
+
+    def is_owned(self, v: VertId) -> bool:
+        return self.parent.owner[self.order[v]] == 0
+
+
+# number of vertex lines that export_to_file joins into one write
+WRITE_CHUNK = 4096
+
+def create_game_file(filename: str):
+    """
+    Opens a game or solution file for text writing, compressed when the name ends in .gz, .bz2 or .xz.
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, 'wt')
+    if filename.endswith(".bz2"):
+        return bz2.open(filename, 'wt')
+    if filename.endswith(".xz"):
+        return lzma.open(filename, 'wt')
+    return open(filename, 'w')
+
+@timed("export")
+def export_to_file(game: Game | SubgameView, filename: str) -> Sequence[VertId]:
+    """
+    Writes game in the PGSolver format, a view in its flat numbering straight from the parent.
+    The initial vertex is named "initial". Returns the id in game, or in the parent of a view,
+    of every written id, so a solution can be translated back.
+    """
+    if isinstance(game, SubgameView):
+        parent = game.parent
+        mapping: Sequence[VertId] = game.order
+        initial = VertId(0) if len(mapping) != 0 and mapping[0] == parent.init else None
+        successors = lambda v: map(str, game.successors(v))
     else:
-        for oldv in oldVertices:
-            mapping[oldv] = VertId(i)
-            i += 1
-
-    newVertices : set[VertId] = set(mapping.values())
-    
-    newInit = mapping[oldInit]
-    
-    newPriority : dict[VertId, Priority] = {mapping[id]:p for (id,p) in oldPriority.items()}
-    
-    newOwned : set[VertId] = {mapping[id] for id in oldOwned}
-    
-    newOutEdges : dict[VertId, set[VertId]] = {mapping[id]:({mapping[dest] for dest in dests}) for (id,dests) in oldOutEdges.items()}
-    
-    newIncEdges : dict[VertId, set[VertId]] = {mapping[id]:({mapping[orig] for orig in origs}) for (id,origs) in oldIncEdges.items()}
-    
-    return (newVertices, newInit, newPriority, newOwned, newOutEdges, newIncEdges)
-
-
-def export_to_file(game: Game, filename: str) -> None:
-    #print("exported to: " + filename)
-    (vertices, init, priority, owned, outEdges, incEdges) = game
-    file = open(filename, "w")
-    file.write("parity " + str(len(vertices)) + ";\n")
-    #print(game)
-    for v in vertices:
-        priorityStr = str(priority[v])
-        ownedStr = "0" if (v in owned) else "1"
-        edgesStr = ",".join(map(str, outEdges[v]))
-        initString: str = (" \"initial\"" if v == init else "")
-        file.write(str(v) + " " + priorityStr + " " + ownedStr + " " + edgesStr + ";\n")
-    
+        parent = game
+        mapping = range(game.num_ids())
+        initial = game.init
+        # the ids of all edge targets are converted at once, a line only joins a slice of them
+        outStart = game.outStart
+        targets = list(map(str, game.outTargets))
+        successors = lambda v: targets[outStart[v]:outStart[v + 1]]
+    priority = parent.priority
+    owner = parent.owner
+
+    def line(v: VertId) -> str:
+        old = mapping[v]
+        end = ' "initial";\n' if v == initial else ';\n'
+        return f'{v} {priority[old]} {owner[old]} {",".join(successors(v))}{end}'
+
+    vertices = iter(game.vertices)
+    with create_game_file(filename) as file:
+        file.write("parity " + str(len(game.vertices)) + ";\n")
+        while True:
+            chunk = "".join(map(line, islice(vertices, WRITE_CHUNK)))
+            if len(chunk) == 0:
+                break
+            file.write(chunk)
+    return mapping
+
+def export_subgame(parent: Game, cVertices: VertexSet, filename: str) -> Sequence[VertId]:
+    """
+    Writes the subgame of parent induced by cVertices with the numbering of flatten_game.
+    """
+    return export_to_file(SubgameView(parent, cVertices), filename)
+
+# a solution line with a strategy: vertex, winner, successor
+STRATEGY_PATTERN = re.compile(rb'(\d+)\s+[01]\s+(\d+)\s*;')
+
+@timed("parse-solution")
 def parse_solution(filename: str) -> dict[VertId, VertId]:
-    file = open(filename, 'r')
-    num_vertices = int(file.readline().strip("\n\r; paritysol"))
-    solution: dict[VertId, VertId] = dict()
-    for i in range(num_vertices):
-        splitline = file.readline().strip("\n\r;").split()
-        if (len(splitline) == 3):
-            solution[VertId(int(splitline[0]))] = VertId(int(splitline[2]))
-    
-    return solution
+    """
+    Parses the strategy of an oink solution file in one pass, the header is not trusted
+    for the number of lines.
+    """
+    data = read_game_file(filename)
+    (_, _, body) = data.partition(b';')
+    pairs = STRATEGY_PATTERN.findall(body)
+    return dict(zip(map(int, [v for (v, _) in pairs]), map(int, [s for (_, s) in pairs])))
 
 def solution_size(game: Game, solution: dict[VertId, VertId]) -> int:
     return len(solution_domain(game, solution))
 
-def solution_domain(game: Game, solution: dict[VertId, VertId]) -> set[VertId]:
-    (vertices, init, priority, owned, outEdges, incEdges) = game
-    dominion: set[VertId] = {init}
-    prevdominion = set()
-    while len(dominion) > len(prevdominion):
-        newlyadded = dominion - prevdominion
-        prevdominion = dominion
-        for v in newlyadded:
-            if v in solution:
-                dominion.add(solution[v])
-            else:
-                dominion |= outEdges[v]
-    
-    return dominion
+def solution_domain(game: Game, solution: dict[VertId, VertId], cVertices: AbstractSet[VertId] | None = None) -> set[VertId]:
+    """
+    The vertices reachable from the initial vertex when the vertices in solution follow
+    their strategy and every other vertex may take any of its edges.
+    Every reached edge is followed once, with a byte per id to mark the reached vertices.
+    With cVertices only the edges within that subgame are followed, with a set for the marks,
+    so the search costs the size of the domain instead of the size of the game.
+    """
+    if cVertices is None:
+        return set(mark_domain(game, solution, [game.init], bytearray(game.num_ids())))
+    domain: set[VertId] = set()
+    if game.init not in cVertices:
+        return domain
+    stack = [game.init]
+    domain.add(game.init)
+    while len(stack) != 0:
+        v = stack.pop()
+        move = solution.get(v)
+        for w in (game.successors(v) if move is None else (move,)):
+            if w not in domain and w in cVertices:
+                domain.add(w)
+                stack.append(w)
+    return domain
+
+def solution_domains(game: Game, solutions: Iterable[dict[VertId, VertId]]) -> list[set[VertId]]:
+    """
+    solution_domain of every strategy in solutions. The mark bytes are shared and cleared
+    through the reached vertices, so a domain costs its own size instead of the size of the game.
+    """
+    seen = bytearray(game.num_ids())
+    domains = []
+    for solution in solutions:
+        reached = mark_domain(game, solution, [game.init], seen)
+        for v in reached:
+            seen[v] = 0
+        domains.append(set(reached))
+    return domains
+
+def mark_domain(game: Game, solution: dict[VertId, VertId], seeds: Iterable[VertId], seen: bytearray) -> list[VertId]:
+    """
+    Marks the vertices reachable from seeds under solution in seen and returns them,
+    marked vertices are neither returned nor searched from.
+    """
+    outStart = game.outStart
+    outTargets = game.outTargets
+    stack = []
+    for v in seeds:
+        if not seen[v]:
+            seen[v] = 1
+            stack.append(v)
+    reached = []
+    while len(stack) != 0:
+        v = stack.pop()
+        reached.append(v)
+        w = solution.get(v)
+        if w is not None:
+            if not seen[w]:
+                seen[w] = 1
+                stack.append(w)
+        else:
+            for w in outTargets[outStart[v]:outStart[v + 1]]:
+                if not seen[w]:
+                    seen[w] = 1
+                    stack.append(w)
+    return reached
+
+def extend_domain(game: Game, solution: dict[VertId, VertId], seeds: Iterable[VertId], domain: set[VertId]) -> None:
+    """
+    mark_domain with a set for the marks, for searches that only touch a small part of the game.
+    """
+    stack = [v for v in set(seeds) if v not in domain]
+    domain.update(stack)
+    while len(stack) != 0:
+        v = stack.pop()
+        move = solution.get(v)
+        for w in (game.successors(v) if move is None else (move,)):
+            if w not in domain:
+                domain.add(w)
+                stack.append(w)
+
+def update_solution_domain(game: Game, domain: set[VertId], oldSolution: dict[VertId, VertId],
+                           newSolution: dict[VertId, VertId], changed: Iterable[VertId]) -> set[VertId]:
+    """
+    Turns domain, the solution domain of oldSolution, into that of newSolution in place and returns it.
+    The strategies may only differ on the vertices in changed.
+    Every vertex of the domain that the old moves of the changed vertices do not lead to is
+    still reached under newSolution, only the rest of the domain is searched again.
+    """
+    changed = [v for v in changed if v in domain]
+    if len(changed) == 0:
+        return domain
+    # the vertices that may have been reached through the old moves only
+    oldMoves = chain.from_iterable((oldSolution[v],) if v in oldSolution else game.successors(v) for v in changed)
+    suspect: set[VertId] = set()
+    extend_domain(game, oldSolution, oldMoves, suspect)
+    domain -= suspect
+    if len(domain) == 0:
+        # the initial vertex was one of them
+        extend_domain(game, newSolution, [game.init], domain)
+        return domain
+
+    # search again from the new moves and from every kept vertex that still moves into the suspects
+    seeds = list(chain.from_iterable((newSolution[v],) if v in newSolution else game.successors(v)
+                                     for v in changed if v in domain))
+    for w in suspect:
+        for v in game.predecessors(w):
+            if v in domain and newSolution.get(v, w) == w:
+                seeds.append(w)
+                break
+    extend_domain(game, newSolution, seeds, domain)
+    return domain
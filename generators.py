@@ -0,0 +1,54 @@
+"""
+Seeded synthetic parity games in the spirit of the PGSolver and oink generators.
+The same arguments always give the same game.
+"""
+from array import array
+from game import Game, VertId, OWNER_TYPE, PRIORITY_TYPE, build_game
+import random
+
+def random_game(n: int, seed: int = 0, maxDegree: int = 3) -> Game:
+    """
+    Every vertex gets a random owner, a priority below n and 1 to maxDegree distinct random successors.
+    """
+    rng = random.Random(seed)
+    priority = array(PRIORITY_TYPE, (rng.randrange(n) for _ in range(n)))
+    owner = array(OWNER_TYPE, (rng.randint(0, 1) for _ in range(n)))
+    outEdges = [rng.sample(range(n), rng.randint(1, min(maxDegree, n))) for _ in range(n)]
+    return build_game(range(n), VertId(0), priority, owner, outEdges)
+
+def ladder_game(n: int, seed: int = 0) -> Game:
+    """
+    n rungs of two vertices, one per player. Both vertices of a rung move to the next rung,
+    the last rung moves back to the first.
+    """
+    rng = random.Random(seed)
+    size = 2 * n
+    priority = array(PRIORITY_TYPE, (2 * rng.randrange(n) + v % 2 for v in range(size)))
+    owner = array(OWNER_TYPE, (v % 2 for v in range(size)))
+    outEdges = [[(v - v % 2 + 2) % size, (v - v % 2 + 3) % size] for v in range(size)]
+    return build_game(range(size), VertId(0), priority, owner, outEdges)
+
+def clique_game(n: int, seed: int = 0) -> Game:
+    """
+    Every vertex moves to every other vertex, owners alternate and the priorities are a random permutation.
+    """
+    rng = random.Random(seed)
+    priorities = list(range(n))
+    rng.shuffle(priorities)
+    priority = array(PRIORITY_TYPE, priorities)
+    owner = array(OWNER_TYPE, (v % 2 for v in range(n)))
+    outEdges = [[w for w in range(n) if w != v] for v in range(n)]
+    return build_game(range(n), VertId(0), priority, owner, outEdges)
+
+def chain_game(n: int, seed: int = 0) -> Game:
+    """
+    A path of n vertices that ends in a self loop, so a forward search needs n layers to reach
+    the end. Owned vertices can also move back to a random earlier vertex.
+    """
+    rng = random.Random(seed)
+    priority = array(PRIORITY_TYPE, (rng.randrange(n) for _ in range(n)))
+    owner = array(OWNER_TYPE, (rng.randint(0, 1) for _ in range(n)))
+    outEdges = [[min(v + 1, n - 1)] + ([rng.randrange(v)] if owner[v] == 0 and v != 0 else []) for v in range(n)]
+    return build_game(range(n), VertId(0), priority, owner, outEdges)
+
+GENERATORS = {'random': random_game, 'ladder': ladder_game, 'clique': clique_game, 'chain': chain_game}
@@ -1,109 +1,172 @@
-from threading import Thread
-from game import Game, VertId, Priority, export_to_file, flatten_game, realise_subgame
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from threading import BoundedSemaphore
+from game import Game, VertId, Priority, export_subgame, search_game, with_init
 from game import parse_game, find_problems
-from sdsi import SDSI
+from sdsi import SDSI, gallop_layers, pipelined_layers, solve_layers, worker_search
 from sdsi_bidirectional import SDSI_bidirectional
 from sdsi_reverse import SDSI_reverse
-import cProfile
+from cache import DEFAULT_CACHE_PATH, make_cached_backend
+from solver import ProcessBackend, Solution, SolverBackend, export_solution, make_backend, map_solution
+import metrics
+from typing import Sequence
 import argparse
 import os
 import shutil
 
-def parse_process_export(algo_to_use):
+ALGORITHMS = {'SDSI': SDSI, 'SDSI-BI': SDSI_bidirectional, 'SDSI-REV': SDSI_reverse}
+
+class ExportPipeline:
+    """
+    Exports subgames in the background on jobs threads, or on jobs processes for games where
+    building the subgame costs more than writing it. At most queueSize exports wait at a time,
+    submit blocks until one is done. A subgame equal to the one submitted before is skipped.
+    close (or leaving the with block) waits for every export and raises the first error.
+    """
+    def __init__(self, game: Game, jobs: int, processes: bool = False, queueSize: int | None = None):
+        self.game = game
+        self.backend: ProcessBackend | None = ProcessBackend('zielonka', jobs) if processes else None
+        self.threads = None if processes else ThreadPoolExecutor(max_workers=jobs)
+        self.slots = BoundedSemaphore(queueSize or 2 * jobs)
+        self.last: frozenset[VertId] | None = None
+        self.errors: list[BaseException] = []
+        # exports that may still run, only touched by the thread that submits
+        self.pending: set[Future] = set()
+
+    def done(self, future: Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            self.errors.append(future.exception())
+        self.slots.release()
+
+    def submit(self, subgameconf: set[VertId], destfile: str) -> bool:
+        subgameconf = frozenset(subgameconf)
+        if subgameconf == self.last:
+            return False
+        self.last = subgameconf
+        self.slots.acquire()
+        if self.backend is not None:
+            future = self.backend.submit_task(export_subgame, self.game, subgameconf, destfile)
+        else:
+            future = self.threads.submit(export_subgame, self.game, subgameconf, destfile)
+        future.add_done_callback(self.done)
+        self.pending = {other for other in self.pending if not other.done()}
+        self.pending.add(future)
+        return True
+
+    def close(self) -> None:
+        # the backend drops the work that did not start yet when it closes, so wait first
+        wait(self.pending)
+        if self.backend is not None:
+            self.backend.close()
+        else:
+            self.threads.shutdown()
+        if len(self.errors) != 0:
+            raise self.errors[0]
+
+    def __enter__(self) -> 'ExportPipeline':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def clear_folder(folder: str) -> None:
     # empty or create destination folder
-    if os.path.exists(args.outputfolder):
-        for file in os.listdir(args.outputfolder):
-            os.remove(os.path.join(args.outputfolder, file))
+    if os.path.exists(folder):
+        for file in os.listdir(folder):
+            path = os.path.join(folder, file)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
     else:
-        os.mkdir(args.outputfolder)
-    
-    
-    game = parse_game(args.inputfile)
-    #print(game)
+        os.mkdir(folder)
 
-    (parentVerts, _, _, _, _, _) = game
-    parentlen = len(parentVerts)
-    algo : algo_to_use = algo_to_use(game, VertId(0))
+
+def parse_process_export(algo_to_use, game: Game, outputfolder: str):
+    clear_folder(outputfolder)
+
+    (searchgame, order) = search_game(game, args.reduce)
+    parentlen = len(searchgame.vertices)
+    algo : algo_to_use = algo_to_use(searchgame, searchgame.init)
     
     subgameconf = algo.prune()
     subgamelen = len(subgameconf)
     size = 1
-    while algo.increase_reach(1):
-        size += 1
-        subgameconf = algo.prune_subset_optimized()
-        subgamelen = len(subgameconf)
-        if subgamelen == parentlen:
-            break
-        
-        if subgamelen <= 1:
-            continue
-        
-        if args.multithreaded:
-            print("new thread started")
-            thread = Thread(target=export_subgame_config, args=(game, subgameconf, args.outputfolder + "/" + str(size) + ".pg"))
-            thread.start()
-        else:
-            export_subgame_config(game, subgameconf, args.outputfolder + "/" + str(size) + ".pg")
-    
-def parse_findsolution_export(algo_to_use):
-    # empty or create destination folder
-    if os.path.exists(args.outputfolder):
-        for file in os.listdir(args.outputfolder):
-            os.remove(os.path.join(args.outputfolder, file))
-    else:
-        os.mkdir(args.outputfolder)
-    
-    # temporary directory unique to this process
-    pid = os.getpid()
-    temp_path = "./kraam_temp_" + str(pid)
-    os.mkdir(temp_path)
+    # without -mt a single export thread keeps at most one layer waiting
+    jobs = (args.jobs or os.cpu_count() or 1) if args.multithreaded else 1
+    with ExportPipeline(game, jobs, args.exportprocesses, 1 if not args.multithreaded else None) as pipeline:
+        while algo.increase_reach(1):
+            size += 1
+            subgameconf = algo.prune_subset_optimized()
+            subgamelen = len(subgameconf)
+            if subgamelen == parentlen:
+                break
+            
+            if subgamelen <= 1:
+                continue
+            
+            if order is not None:
+                subgameconf = {order[v] for v in subgameconf}
+            # layers that did not change the pruned subgame are not exported again
+            pipeline.submit(subgameconf, outputfolder + "/" + str(size) + ".pg")
     
+def parse_findsolution_export(algo_to_use, backend: SolverBackend, game: Game, outputfolder: str):
+    clear_folder(outputfolder)
     
+    (searchgame, order) = search_game(game, args.reduce)
+    if args.galloping or args.pipelined:
+        if args.galloping:
+            found = gallop_layers(searchgame, algo_to_use, backend)
+        else:
+            found = pipelined_layers(searchgame, algo_to_use, backend, args.ahead)
+        if found is None:
+            print("no layer is won by player 0")
+            return
+        (size, subgameconf, solution) = found
+        print("found winner in layer " + str(size))
+        print("copied solution to: " + outputfolder)
+        export_found(game, order, subgameconf, solution, outputfolder)
+        return
     
-    game: Game = parse_game(args.inputfile)
-    
-    (parentVerts, _, _, _, _, _) = game
-    parentlen = len(parentVerts)
-    algo : algo_to_use = algo_to_use(game, VertId(0))
-    
-    subgameconf = algo.prune()
-    subgamelen = len(subgameconf)
-    size = 1
-    while algo.increase_reach(1):
-        size += 1
-        subgameconf = algo.prune_subset_optimized()
-        subgamelen = len(subgameconf)
-        
-        if subgamelen <= 1:
-            continue
-        
-        # no multithreading possible
-        export_subgame_config(game, subgameconf, temp_path + "/subgame.pg")
-        
+    for (size, subgameconf, solution) in solve_layers(searchgame, algo_to_use, backend):
         # check if solvable
-        os.system("oink '" + temp_path + "/subgame.pg' '" + temp_path + "/subgame.pg.sol'")
-        solfile = open(temp_path + "/subgame.pg.sol", "r")
-        solfile.readline()
-        winner_int = solfile.readline().strip("\n\r;").split()[1]
+        winner_int = str(solution.winner)
         print("winner int: " + winner_int)
         if winner_int == "0":
             print("found winner")
-            print("copied solution to: " + args.outputfolder)
+            print("copied solution to: " + outputfolder)
             # solution found, storing in desired location
-            shutil.copyfile(
-                temp_path + "/subgame.pg",
-                args.outputfolder + "/subgame.pg"
-            )
-            shutil.copyfile(
-                temp_path + "/subgame.pg.sol",
-                args.outputfolder + "/subgame.pg.sol"
-            )
-            break
-        
-        if subgamelen == parentlen:
+            export_found(game, order, subgameconf, solution, outputfolder)
             break
 
-    shutil.rmtree(temp_path)
+def export_found(game: Game, order: Sequence[VertId] | None, subgameconf: set[VertId], solution: Solution, outputfolder: str):
+    if order is not None:
+        subgameconf = {order[v] for v in subgameconf}
+        solution = map_solution(game, solution, order)
+    export_subgame_config(game, subgameconf, outputfolder + "/subgame.pg")
+    export_solution(game, solution, outputfolder + "/subgame.pg.sol")
+
+def findsolution_multistart(algo_to_use, backend: SolverBackend, game: Game, starts: list[VertId]):
+    """
+    Searches from every start vertex in parallel on the workers of backend, which all hold the
+    game. The subgame and solution of start v are written to the folder v in the output folder.
+    """
+    clear_folder(args.outputfolder)
+    futures = {backend.submit_task(worker_search, game, v, algo_to_use, os.path.join(args.outputfolder, str(v)), args.galloping): v
+               for v in starts}
+    for future in as_completed(futures):
+        v = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            print("start " + str(v) + ": " + repr(e))
+            continue
+        if result is None:
+            print("start " + str(v) + ": no subgame won by player 0")
+        else:
+            (size, subgamelen, solutionlen) = result
+            print("start " + str(v) + ": layer " + str(size) + ", subgame of " + str(subgamelen)
+                  + " vertices, solution of " + str(solutionlen))
     
     
         
@@ -112,24 +175,62 @@ def parse_findsolution_export(algo_to_use):
     
 
 def export_subgame_config(game: Game, subgameconf: set[VertId], destfile: str):
-    subgame = realise_subgame(game, subgameconf)
-    #print("subgame:\n" + str(subgame) + "\n\n")
-    subgame = flatten_game(subgame)
-    #print("flattened subgame:\n" + str(subgame) + "\n\n")
-    export_to_file(subgame, destfile)
+    export_subgame(game, subgameconf, destfile)
+
+
+def start_vertices(game: Game, specs: list[str] | None) -> list[VertId]:
+    """
+    The start vertices given with -sv: vertex ids, ranges like 10-20 (both ends included) and
+    player0 for every vertex of player 0. Without -sv the initial vertex of the game is the only one.
+    """
+    if specs is None:
+        return [game.init]
+    starts: list[VertId] = []
+    for spec in specs:
+        if spec == 'player0':
+            starts.extend(v for v in sorted(game.vertices) if game.owner[v] == 0)
+        elif '-' in spec:
+            (first, _, last) = spec.partition('-')
+            starts.extend(map(VertId, range(int(first), int(last) + 1)))
+        else:
+            starts.append(VertId(int(spec)))
+    for v in starts:
+        if v not in game.vertices:
+            parser.error("start vertex " + str(v) + " is not a vertex of the game")
+    return list(dict.fromkeys(starts))
+
+
+def run_algorithm(algo_to_use, backend: SolverBackend, game: Game, starts: list[VertId]):
+    if len(starts) == 1:
+        game = with_init(game, starts[0])
+        if args.exportlayers:
+            parse_process_export(algo_to_use, game, args.outputfolder)
+        else:
+            parse_findsolution_export(algo_to_use, backend, game, args.outputfolder)
+    elif args.exportlayers:
+        # the layers of one start are already exported in parallel, the starts go one by one
+        clear_folder(args.outputfolder)
+        for v in starts:
+            parse_process_export(algo_to_use, with_init(game, v), os.path.join(args.outputfolder, str(v)))
+    else:
+        findsolution_multistart(algo_to_use, backend, game, starts)
 
 
 def main_func():
-    match args.algorithm:
-        case 'SDSI':
-            parse_findsolution_export(SDSI)
-        case 'SDSI-BI':
-            parse_findsolution_export(SDSI_bidirectional)
-        case 'SDSI-REV':
-            parse_findsolution_export(SDSI_reverse)
-        case _:
-            print("Algorithm not recognized!")
-            print("Available: 'SDSI', 'SDSI-BI', 'SDSI-REV")
+    if args.algorithm not in ALGORITHMS:
+        print("Algorithm not recognized!")
+        print("Available: 'SDSI', 'SDSI-BI', 'SDSI-REV")
+        return
+
+    game: Game = parse_game(args.inputfile, report=args.profile)
+    starts = start_vertices(game, args.initialvertex)
+    if args.reduce and len(starts) > 1:
+        parser.error("-reduce needs a single start vertex, the game is reduced around it")
+    # several starts are searched at once on worker processes that each hold the game
+    processes = len(starts) > 1 and not args.exportlayers
+    cache = None if args.nocache else args.cache
+    with make_cached_backend(make_backend(args.solver, args.jobs, processes), cache, args.cachesize, args.solver) as backend:
+        run_algorithm(ALGORITHMS[args.algorithm], backend, game, starts)
 
 
 parser = argparse.ArgumentParser(
@@ -139,14 +240,26 @@ parser = argparse.ArgumentParser(
 parser.add_argument('inputfile')
 parser.add_argument('outputfolder')
 parser.add_argument('-algo', '--algorithm', default = 'SDSI')
-parser.add_argument('-sv', '--initialvertex', default=0)
+parser.add_argument('-sv', '--initialvertex', nargs='+', help='start vertices: ids, ranges like 10-20 or player0, several are searched in parallel')
 parser.add_argument('-p', '--profile', action='store_true')
+parser.add_argument('-po', '--profileout', help='write the profile to this pstats file instead of printing it')
+parser.add_argument('-m', '--metrics', help='append the phase timings and counters of the run to this JSON lines file')
 parser.add_argument('-mt', '--multithreaded', action='store_true')
 parser.add_argument('-opf', '--optimizedproblemfinder', action='store_true')
+parser.add_argument('-solver', '--solver', choices=['oink', 'zielonka'], default='oink')
+parser.add_argument('-j', '--jobs', type=int)
+parser.add_argument('-layers', '--exportlayers', action='store_true')
+parser.add_argument('-pipe', '--pipelined', action='store_true', help='expand, prune and solve the next layers while a layer is solved')
+parser.add_argument('-ahead', '--ahead', type=int, help='layers solved at the same time with -pipe, the number of jobs plus one by default')
+parser.add_argument('-reduce', '--reduce', action='store_true', help='search on the reduced game, the results keep the ids of the input game')
+parser.add_argument('-gallop', '--galloping', action='store_true', help='double the depth until a layer is won, then bisect down to the first won layer')
+parser.add_argument('-xp', '--exportprocesses', action='store_true')
+parser.add_argument('-cache', '--cache', default=DEFAULT_CACHE_PATH)
+parser.add_argument('-cachesize', '--cachesize', type=int, default=256)
+parser.add_argument('-nocache', '--nocache', action='store_true')
 
 args = parser.parse_args()
 
-if (args.profile):
-    cProfile.run("main_func()")
-else:
-    main_func()
\ No newline at end of file
+# worker processes that import this file must not start a search of their own
+if __name__ == '__main__':
+    metrics.run(main_func, args.profile, args.profileout, args.metrics)
\ No newline at end of file
@@ -0,0 +1,130 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from game import Game, parse_game
+from sdsi import SDSI, solve_layers
+from sdsi_bidirectional import SDSI_bidirectional
+from sdsi_reverse import SDSI_reverse
+import solver
+import argparse
+import csv
+import json
+import os
+import signal
+import time
+
+ALGORITHMS = {'SDSI': SDSI, 'SDSI-BI': SDSI_bidirectional, 'SDSI-REV': SDSI_reverse}
+# 'original' solves the whole game, it gives the solution size the subgames are compared to
+CHOICES = ['original'] + list(ALGORITHMS)
+FIELDS = ['game', 'algorithm', 'vertices', 'layer', 'subgame', 'solution', 'seconds', 'status']
+
+
+class JobTimeout(Exception):
+    pass
+
+def raise_timeout(signum, frame):
+    raise JobTimeout()
+
+def init_batch_worker(name: str) -> None:
+    solver.init_worker(None, name)
+    signal.signal(signal.SIGALRM, raise_timeout)
+
+
+def run_job(game: Game, algorithm: str, row: dict) -> None:
+    backend = solver.worker_backend
+    if algorithm == 'original':
+        solution = backend.solve(game, game.vertices)
+        row.update(subgame=len(game), solution=len(solution.domain), status='ok')
+        return
+    for (layer, subgameconf, solution) in solve_layers(game, ALGORITHMS[algorithm], backend):
+        if solution.winner == 0:
+            row.update(layer=layer, subgame=len(subgameconf), solution=len(solution.domain), status='ok')
+            return
+    row.update(status='nosolution')
+
+def run_game(path: str, algorithms: list[str], timeout: float) -> list[dict]:
+    """
+    Parses the game once and runs every algorithm on it, each one within timeout seconds.
+    """
+    game = parse_game(path)
+    rows = []
+    for algorithm in algorithms:
+        row = dict.fromkeys(FIELDS, '')
+        row.update(game=os.path.basename(path), algorithm=algorithm, vertices=len(game))
+        startTime = time.perf_counter()
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            run_job(game, algorithm, row)
+        except JobTimeout:
+            row['status'] = 'timeout'
+        except Exception as e:
+            row['status'] = 'error: ' + repr(e)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        row['seconds'] = round(time.perf_counter() - startTime, 3)
+        rows.append(row)
+    return rows
+
+
+def read_results(filename: str) -> list[dict]:
+    if not os.path.exists(filename):
+        return []
+    with open(filename, newline='') as file:
+        if filename.endswith('.json'):
+            return json.load(file)
+        return list(csv.DictReader(file))
+
+def write_results(filename: str, rows: list[dict]) -> None:
+    # written next to the results and moved over them, an interrupted batch keeps its last complete file
+    rows = sorted(rows, key=lambda row: (row['game'], CHOICES.index(row['algorithm'])))
+    with open(filename + '.tmp', 'w', newline='') as file:
+        if filename.endswith('.json'):
+            json.dump(rows, file, indent=1)
+        else:
+            writer = csv.DictWriter(file, FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    os.replace(filename + '.tmp', filename)
+
+
+def main_func():
+    # rows of an earlier run are kept, only jobs that failed with an error are run again
+    rows = [row for row in read_results(args.results) if not row['status'].startswith('error')]
+    finished = {(row['game'], row['algorithm']) for row in rows}
+
+    todo: dict[str, list[str]] = dict()
+    for name in sorted(os.listdir(args.gamefolder)):
+        algorithms = [algorithm for algorithm in args.algorithms if (name, algorithm) not in finished]
+        if len(algorithms) != 0:
+            todo[name] = algorithms
+    print(str(sum(map(len, todo.values()))) + " jobs on " + str(len(todo)) + " games, " + str(len(finished)) + " already done")
+
+    with ProcessPoolExecutor(max_workers=args.jobs or os.cpu_count() or 1, initializer=init_batch_worker, initargs=(args.solver,)) as pool:
+        futures = {pool.submit(run_game, os.path.join(args.gamefolder, name), algorithms, args.timeout): name
+                   for (name, algorithms) in todo.items()}
+        for future in as_completed(futures):
+            try:
+                newRows = future.result()
+            except Exception as e:
+                # the game itself could not be read, the next run tries again
+                print(futures[future] + ": " + repr(e))
+                continue
+            for row in newRows:
+                print(row['game'] + " " + row['algorithm'] + ": " + row['status'] + ", solution " + str(row['solution']) + " in " + str(row['seconds']) + "s")
+            rows.extend(newRows)
+            write_results(args.results, rows)
+
+
+parser = argparse.ArgumentParser(
+    prog='kraam batch',
+    description='Runs kraam algorithms on every game in a folder and collects the solution sizes.'
+)
+parser.add_argument('gamefolder')
+parser.add_argument('results', help='.csv or .json file, jobs that are already in it are skipped')
+parser.add_argument('-algo', '--algorithms', nargs='+', choices=CHOICES, default=CHOICES)
+parser.add_argument('-solver', '--solver', choices=['oink', 'zielonka'], default='oink')
+parser.add_argument('-j', '--jobs', type=int)
+parser.add_argument('-t', '--timeout', type=float, default=100, help='seconds per job, 0 for none')
+
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    main_func()
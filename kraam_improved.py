@@ -1,135 +1,78 @@
-import itertools
 from threading import Thread
-from game import Game, VertId, Priority, export_to_file, find_problems_on_specified_verts, flatten_game, parse_solution, realise_subgame, solution_domain, solution_size
-from game import parse_game, find_problems
+from game import Game, SubgameView, VertId, Priority, export_to_file
+from game import parse_game, search_game, with_init
 from sdsi import SDSI
 from sdsi_bidirectional import SDSI_bidirectional
 from sdsi_reverse import SDSI_reverse
-import cProfile
+from pruning import valid_subgames
+from cache import DEFAULT_CACHE_PATH, make_cached_backend
+from solver import SolverBackend, first_won, make_backend, worker_first_won
+import metrics
 import argparse
-import os
-import shutil
 import math
 
-CMD_NO_OUT_STR: str = " >/dev/null 2>&1"
-
-def parse_findsolution_export(algo_to_use):
-    # temporary directory unique to this process
-    pid = os.getpid()
-    temp_dir = "./kraam_temp_" + str(pid)
-    os.mkdir(temp_dir)
-    temp_path = temp_dir + "/temp"
-        
-    game: Game = parse_game(args.inputfile)
+def parse_findsolution_export(algo_to_use, backend: SolverBackend):
+    game: Game = parse_game(args.inputfile, report=args.profile)
+    if args.initialvertex is not None:
+        game = with_init(game, VertId(args.initialvertex))
+    original = game
+    (game, order) = search_game(original, args.reduce)
     
-    (vertices, init, priority, owned, outEdges, incEdges) = game
+    vertices: set[VertId] = set(game.vertices)
     
     # solve, the size of the solution will be used as the max size of any future subgames
     totalsize: int = len(vertices)
-    best_subgame: set[VertId] = get_solution_domain(game, vertices, temp_path)
+    solution = backend.solve(game, vertices)
+    # when player 0 loses the game there is no smaller subgame, the game itself is the result
+    best_subgame: set[VertId] = solution.domain if solution.winner == 0 else vertices
     best_solsize: int = len(best_subgame)
     
     
-    subgames_checked: set[frozenset[VertId]] = set()
-    
-    # init vertex is removed and then added back so that each subgraph contains the init vertex
-    # subtract 2 from minsize. One because the init vertex will be added,
-    # the other because we are only looking for _smaller_ subgraphs
+    # every subgame that a combination of vertices prunes to is itself a valid subgame of at most
+    # that size, so enumerating the valid subgames by size reaches the same subgames, each once
     print("best_solsize: " + str(best_solsize))
     num_options = math.factorial(totalsize) / (math.factorial(best_solsize) * math.factorial(totalsize - best_solsize))
     print("that means " + str(num_options) + " options")
     for i in range(2, best_solsize):
         print("now looking into subgraphs with " + str(i) + " vertices")
-        found = False
-        for sg in set(itertools.combinations(vertices - {VertId(0)}, i - 1)):
-            subgraph: set[VertId] = set(sg)
-            subgraph.add(VertId(0))
-            subgame = prune(game, subgraph)
-            if len(subgame) < 2:
-                continue
-            
-            if frozenset(subgame) in subgames_checked:
-                continue
-            
-            subgames_checked.add(frozenset(subgame))
-            
-            if not check_solvable(game, subgame, temp_path):
-                continue
-            
-            best_subgame = get_solution_domain(game, subgame, temp_path + ".sol")
-            best_solsize = len(best_subgame)
-            found = True
-            break
+        if args.multithreaded:
+            shards = [backend.submit_task(worker_first_won, game, i, game.init, shard, backend.jobs) for shard in range(backend.jobs)]
+            # the lowest ticket is the subgame the enumeration without shards finds first
+            found = min((f for f in [future.result() for future in shards] if f is not None), key=lambda f: f[0], default=None)
+        else:
+            found = first_won(backend, game, valid_subgames(game, i, game.init))
+        if found is None:
+            continue
         
-        if found:
-            break
+        best_subgame = found[1].domain
+        best_solsize = len(best_subgame)
+        break
             
+    if order is not None:
+        best_subgame = {order[v] for v in best_subgame}
     print("solution size: " + str(best_solsize))
     print("solution: " + str(best_subgame))
-    export_subgame_config(game, best_subgame, args.outputfolder)
-
-    shutil.rmtree(temp_dir)
+    export_subgame_config(original, best_subgame, args.outputfolder)
     
         
     
-def check_solvable(game: Game, subgameconf: set[VertId], temp_path: str) -> bool:
-    export_subgame_config(game, subgameconf, temp_path)
-    os.system("oink " + temp_path + " " + temp_path + ".sol" + CMD_NO_OUT_STR)
-    solfile = open(temp_path + ".sol", "r")
-    solfile.readline() # skip first line
-    # tempfile does not need to be deleted, will be overwritten and deleted at the end
-    return solfile.readline().strip("\n\r;").split()[1] == "0"
-
-def get_solution_size(game: Game, subgameconf: set[VertId], temp_path: str) -> int:
-    export_subgame_config(game, subgameconf, temp_path)
-    os.system("oink " + temp_path + " " + temp_path + ".sol" + CMD_NO_OUT_STR)
-    return solution_size(game, parse_solution(temp_path + ".sol"))
-
-def get_solution_domain(game: Game, subgameconf: set[VertId], temp_path: str) -> set[VertId]:
-    export_subgame_config(game, subgameconf, temp_path)
-    os.system("oink " + temp_path + " " + temp_path + ".sol" + CMD_NO_OUT_STR)
-    return solution_domain(game, parse_solution(temp_path + ".sol"))
-    
-    
-def prune(game: Game, potentialconf: set[VertId]) -> set[VertId]:
-    (_, init, _, _, _, incEdges) = game
-    
-    pruneResult = potentialconf.copy()
-    
-    (rule1breaks, rule2breaks) = find_problems(game, pruneResult)
-    while not (len(rule1breaks) == 0 and len(rule2breaks) == 0):
-        pruneTargets = set(rule1breaks.keys()) | rule2breaks
-        if init in pruneTargets:
-            return set()
-        pruneResult -= pruneTargets
-        
-        # find out which vertices may now become an issue
-        newlyExposedVerts : set[VertId] = set()
-        for v in pruneTargets:
-            newlyExposedVerts |= incEdges[v]
-        (rule1breaks, rule2breaks) = find_problems_on_specified_verts(game, pruneResult, newlyExposedVerts)
-
-    return pruneResult
-
 def export_subgame_config(game: Game, subgameconf: set[VertId], destfile: str):
-    subgame = realise_subgame(game, subgameconf)
-    #print("subgame:\n" + str(subgame) + "\n\n")
-    subgame = flatten_game(subgame)
-    #print("flattened subgame:\n" + str(subgame) + "\n\n")
-    export_to_file(subgame, destfile)
+    export_to_file(SubgameView(game, subgameconf), destfile)
 
 
 def main_func():
-    match args.algorithm:
-        case 'SDSI':
-            parse_findsolution_export(SDSI)
-        case 'SDSI-BI':
-            parse_findsolution_export(SDSI_bidirectional)
-        case 'SDSI-REV':
-            parse_findsolution_export(SDSI_reverse)
-        case _:
-            print("Algorithm not recognized!")
-            print("Available: 'SDSI', 'SDSI-BI', 'SDSI-REV")
+    cache = None if args.nocache else args.cache
+    with make_cached_backend(make_backend(args.solver, args.jobs, processes=args.multithreaded), cache, args.cachesize, args.solver) as backend:
+        match args.algorithm:
+            case 'SDSI':
+                parse_findsolution_export(SDSI, backend)
+            case 'SDSI-BI':
+                parse_findsolution_export(SDSI_bidirectional, backend)
+            case 'SDSI-REV':
+                parse_findsolution_export(SDSI_reverse, backend)
+            case _:
+                print("Algorithm not recognized!")
+                print("Available: 'SDSI', 'SDSI-BI', 'SDSI-REV")
 
 
 parser = argparse.ArgumentParser(
@@ -139,14 +82,21 @@ parser = argparse.ArgumentParser(
 parser.add_argument('inputfile')
 parser.add_argument('outputfolder')
 parser.add_argument('-algo', '--algorithm', default = 'SDSI')
-parser.add_argument('-sv', '--initialvertex', default=0)
+parser.add_argument('-sv', '--initialvertex', type=int, help='search from this vertex instead of the initial vertex of the game')
 parser.add_argument('-p', '--profile', action='store_true')
+parser.add_argument('-po', '--profileout', help='write the profile to this pstats file instead of printing it')
+parser.add_argument('-m', '--metrics', help='append the phase timings and counters of the run to this JSON lines file')
 parser.add_argument('-mt', '--multithreaded', action='store_true')
 parser.add_argument('-opf', '--optimizedproblemfinder', action='store_true')
+parser.add_argument('-solver', '--solver', choices=['oink', 'zielonka'], default='oink')
+parser.add_argument('-j', '--jobs', type=int)
+parser.add_argument('-cache', '--cache', default=DEFAULT_CACHE_PATH)
+parser.add_argument('-cachesize', '--cachesize', type=int, default=256)
+parser.add_argument('-nocache', '--nocache', action='store_true')
+parser.add_argument('-reduce', '--reduce', action='store_true', help='search on the reduced game, the result keeps the ids of the input game')
 
 args = parser.parse_args()
 
-if (args.profile):
-    cProfile.run("main_func()")
-else:
-    main_func()
\ No newline at end of file
+# worker processes that import this file must not start a search of their own
+if __name__ == '__main__':
+    metrics.run(main_func, args.profile, args.profileout, args.metrics)
\ No newline at end of file
@@ -1,198 +1,181 @@
 import itertools
+from concurrent.futures import Future
 from threading import Thread
-from game import Game, VertId, Priority, export_to_file, find_problems_on_specified_verts, flatten_game, parse_solution, realise_subgame, solution_domain, solution_size
-from game import parse_game, find_problems
+from game import BitSet, Game, SubgameView, VertId, Priority, export_to_file
+from game import parse_game, search_game, with_init
 from sdsi import SDSI
 from sdsi_bidirectional import SDSI_bidirectional
 from sdsi_reverse import SDSI_reverse
-import cProfile
+from pruning import prune_neighbours
+from cache import DEFAULT_CACHE_PATH, make_cached_backend
+from solver import Solution, SolverBackend, make_backend
+from metrics import count
+from checkpoint import Checkpointer
+import metrics
 import argparse
-import os
-import shutil
 import math
 
-CMD_NO_OUT_STR: str = " >/dev/null 2>&1"
 TOPSIZE = 10
 
-def parse_findsolution_export():
-    # temporary directory unique to this process
-    pid = os.getpid()
-    temp_dir = "./kraam_temp_" + str(pid)
-    os.mkdir(temp_dir)
-    temp_path = temp_dir + "/temp"
-        
-    game: Game = parse_game(args.inputfile)
+def parse_findsolution_export(backend: SolverBackend):
+    game: Game = parse_game(args.inputfile, report=args.profile)
+    if args.initialvertex is not None:
+        game = with_init(game, VertId(args.initialvertex))
+    original = game
+    (game, order) = search_game(original, args.reduce)
     
-    (vertices, init, priority, owned, outEdges, incEdges) = game
+    vertices: set[VertId] = set(game.vertices)
     
     # solve, the size of the solution will be used as the max size of any future subgames
     totalsize: int = len(vertices)
     
-    subgames_evaluated: set[frozenset[VertId]] = set()
+    subgames_evaluated: set[BitSet] = set()
     
-    subgame_perf: dict[frozenset[VertId], int] = dict()
-    # set full game as initial subgame
-    subgame_perf[frozenset(vertices)] = get_solution_size(game, vertices, temp_path)
+    subgame_perf: dict[BitSet, int] = dict()
+    checkpoint = Checkpointer(args.checkpoint, game, "plain", subgame_perf, subgames_evaluated, args.checkpointevery)
+    if not checkpoint.load():
+        # set full game as initial subgame
+        subgame_perf[BitSet(vertices)] = len(backend.solve(game, vertices).domain)
     
-    while True:
-        last_best = min(subgame_perf.values())
+    with checkpoint:
+        while True:
+            last_best = min(subgame_perf.values())
         
-        not_evaluated = (subgame_perf.keys() - subgames_evaluated)
-        to_check = get_perf_order({k:v for k,v in subgame_perf.items() if k in not_evaluated})
-        subgames_evaluated |= not_evaluated
-        for i in range(min(TOPSIZE, len(to_check))):
-            sg = to_check[i]
-
-            for v in sg:
-                if v == VertId(0):
-                    continue
-                newsg: frozenset[VertId] = frozenset(prune(game, set(sg-{v})))
-                if len(newsg) < 2:
-                    continue
-                
-                if newsg in subgame_perf.keys():
+            not_evaluated = (subgame_perf.keys() - subgames_evaluated)
+            to_check = get_perf_order({k:v for k,v in subgame_perf.items() if k in not_evaluated})
+            # a round is only applied once it is complete, so a checkpoint always falls between rounds
+            found: dict[BitSet, int] = dict()
+            for (newsg, solution) in solve_neighbours(game, to_check[:TOPSIZE], subgame_perf, backend):
+                if solution.winner != 0:
                     continue
+            
+                found[newsg] = len(solution.domain)
                 
-                if not check_solvable(game, set(newsg), temp_path):
-                    continue
-                
-                subgame_perf[frozenset(newsg)] = get_solution_size(game, set(newsg), temp_path)
-                
-        
-        if not last_best > min(subgame_perf.values()):
-            break
+            subgame_perf.update(found)
+            # only marked once their neighbours are in, a checkpoint never skips a subgame
+            subgames_evaluated |= not_evaluated
+            checkpoint.save_if_due()
+            if not last_best > min(subgame_perf.values()):
+                break
             
     
     best_perf = min(subgame_perf.values())
     best_subgames = [k for k in subgame_perf if subgame_perf[k] == best_perf]
-    #smallest_subgame = get_solution_domain(game, set(best_subgames[0]), temp_path)
+    #smallest_subgame = backend.solve(game, set(best_subgames[0])).domain
     smallest_subgame = best_subgames[0]
+    if order is not None:
+        smallest_subgame = BitSet(order[v] for v in smallest_subgame)
     print("solsize: " + str(len(smallest_subgame)))
-    print("smallest subgame: " + str(smallest_subgame))
-    export_subgame_config(game, set(smallest_subgame), args.outputfolder)
-
-    shutil.rmtree(temp_dir)
-    
-def parse_findsolution_export_sol_domain_accelerated():
-    # temporary directory unique to this process
-    pid = os.getpid()
-    temp_dir = "./kraam_temp_" + str(pid)
-    os.mkdir(temp_dir)
-    temp_path = temp_dir + "/temp"
-        
-    game: Game = parse_game(args.inputfile)
+    print("smallest subgame: " + str(frozenset(smallest_subgame)))
+    export_subgame_config(original, set(smallest_subgame), args.outputfolder)
     
-    (vertices, init, priority, owned, outEdges, incEdges) = game
+def parse_findsolution_export_sol_domain_accelerated(backend: SolverBackend):
+    game: Game = parse_game(args.inputfile, report=args.profile)
+    if args.initialvertex is not None:
+        game = with_init(game, VertId(args.initialvertex))
+    original = game
+    (game, order) = search_game(original, args.reduce)
+    
+    vertices: set[VertId] = set(game.vertices)
     
     # solve, the size of the solution will be used as the max size of any future subgames
     totalsize: int = len(vertices)
     
-    subgames_evaluated: set[frozenset[VertId]] = set()
+    subgames_evaluated: set[BitSet] = set()
     
-    subgame_perf: dict[frozenset[VertId], int] = dict()
-    # set full game as initial subgame
-    subgame_perf[frozenset(vertices)] = get_solution_size(game, vertices, temp_path)
+    subgame_perf: dict[BitSet, int] = dict()
+    checkpoint = Checkpointer(args.checkpoint, game, "sda", subgame_perf, subgames_evaluated, args.checkpointevery)
+    if not checkpoint.load():
+        # set full game as initial subgame
+        subgame_perf[BitSet(vertices)] = len(backend.solve(game, vertices).domain)
     
-    while True:
-        last_best = min(subgame_perf.values())
+    with checkpoint:
+        while True:
+            last_best = min(subgame_perf.values())
         
-        not_evaluated = (subgame_perf.keys() - subgames_evaluated)
-        to_check = get_perf_order({k:v for k,v in subgame_perf.items() if k in not_evaluated})
-        subgames_evaluated |= not_evaluated
-        for i in range(min(TOPSIZE, len(to_check))):
-            sg = to_check[i]
-
-            for v in sg:
-                if v == VertId(0):
+            not_evaluated = (subgame_perf.keys() - subgames_evaluated)
+            to_check = get_perf_order({k:v for k,v in subgame_perf.items() if k in not_evaluated})
+            # a round is only applied once it is complete, so a checkpoint always falls between rounds
+            found: dict[BitSet, int] = dict()
+            for (newsg, solution) in solve_neighbours(game, to_check[:TOPSIZE], subgame_perf, backend):
+                # may have been added as the domain of an earlier neighbour
+                if newsg in subgame_perf.keys() or newsg in found:
                     continue
-                newsg: frozenset[VertId] = frozenset(prune(game, set(sg-{v})))
-                if len(newsg) < 2:
-                    continue
-                
-                if newsg in subgame_perf.keys():
-                    continue
-                
-                if not check_solvable(game, set(newsg), temp_path):
+            
+                if solution.winner != 0:
                     continue
+            
+                found[BitSet(solution.domain)] = len(solution.domain)
                 
-                newsoldomain = get_solution_domain(game, set(newsg), temp_path)
-                subgame_perf[frozenset(newsoldomain)] = get_solution_size(game, set(newsg), temp_path)
-                
-        
-        if not last_best > min(subgame_perf.values()):
-            break
+            subgame_perf.update(found)
+            # only marked once their neighbours are in, a checkpoint never skips a subgame
+            subgames_evaluated |= not_evaluated
+            checkpoint.save_if_due()
+            if not last_best > min(subgame_perf.values()):
+                break
             
     
     best_perf = min(subgame_perf.values())
     best_subgames = [k for k in subgame_perf if subgame_perf[k] == best_perf]
-    smallest_subgame = get_solution_domain(game, set(best_subgames[0]), temp_path)
+    solution = backend.solve(game, set(best_subgames[0]))
+    # when player 0 loses the game there is no smaller subgame, the game itself is the result
+    smallest_subgame = solution.domain if solution.winner == 0 else set(best_subgames[0])
+    if order is not None:
+        smallest_subgame = {order[v] for v in smallest_subgame}
     print("solsize: " + str(len(smallest_subgame)))
     print("smallest subgame: " + str(smallest_subgame))
-    export_subgame_config(game, smallest_subgame, args.outputfolder)
+    export_subgame_config(original, smallest_subgame, args.outputfolder)
 
-    shutil.rmtree(temp_dir)
-
-def get_perf_order(perf_order: dict[frozenset[VertId], int]) -> list[frozenset[VertId]]:
+def get_perf_order(perf_order: dict[BitSet, int]) -> list[BitSet]:
     return [k for k, _ in sorted(perf_order.items(), key=lambda item:item[1])]
     
-def check_solvable(game: Game, subgameconf: set[VertId], temp_path: str) -> bool:
-    export_subgame_config(game, subgameconf, temp_path)
-    os.system("oink " + temp_path + " " + temp_path + ".sol" + CMD_NO_OUT_STR)
-    solfile = open(temp_path + ".sol", "r")
-    solfile.readline() # skip first line
-    # tempfile does not need to be deleted, will be overwritten and deleted at the end
-    return solfile.readline().strip("\n\r;").split()[1] == "0"
-
-def get_solution_size(game: Game, subgameconf: set[VertId], temp_path: str) -> int:
-    export_subgame_config(game, subgameconf, temp_path)
-    os.system("oink " + temp_path + " " + temp_path + ".sol" + CMD_NO_OUT_STR)
-    return solution_size(game, parse_solution(temp_path + ".sol"))
-
-def get_solution_domain(game: Game, subgameconf: set[VertId], temp_path: str) -> set[VertId]:
-    export_subgame_config(game, subgameconf, temp_path)
-    os.system("oink " + temp_path + " " + temp_path + ".sol" + CMD_NO_OUT_STR)
-    return solution_domain(game, parse_solution(temp_path + ".sol"))
-    
-    
-def prune(game: Game, potentialconf: set[VertId]) -> set[VertId]:
-    (_, init, _, _, _, incEdges) = game
+def solve_neighbours(game: Game, sgs: list[BitSet], subgame_perf: dict[BitSet, int],
+                     backend: SolverBackend) -> list[tuple[BitSet, Solution]]:
+    """
+    Prunes every neighbour (one vertex removed) of the subgames in sgs and solves the ones
+    that were not seen before. Pruning and solving are both submitted as a whole batch,
+    the results are in the order a one-by-one search would find them.
+    """
+    pruned: list[tuple[BitSet, Future]] = []
+    for sg in sgs:
+        removals = [v for v in sg if v != game.init]
+        chunksize = max(1, -(-len(removals) // backend.jobs))
+        for i in range(0, len(removals), chunksize):
+            pruned.append((sg, backend.submit_task(prune_neighbours, game, sg, removals[i:i + chunksize], game.init)))
+    
+    candidates: list[BitSet] = []
+    seen: set[BitSet] = set()
+    generated = 0
+    for (sg, future) in pruned:
+        for removed in future.result():
+            newsg: BitSet = sg - removed
+            if len(newsg) < 2:
+                continue
+            
+            generated += 1
+            if newsg in subgame_perf.keys() or newsg in seen:
+                continue
+            
+            seen.add(newsg)
+            candidates.append(newsg)
+    count("candidates generated", generated)
+    count("candidates deduplicated", generated - len(candidates))
+    count("candidates evaluated", len(candidates))
     
-    pruneResult = potentialconf.copy()
+    futures = [backend.submit(game, newsg) for newsg in candidates]
+    return [(newsg, future.result()) for (newsg, future) in zip(candidates, futures)]
     
-    (rule1breaks, rule2breaks) = find_problems(game, pruneResult)
-    while not (len(rule1breaks) == 0 and len(rule2breaks) == 0):
-        pruneTargets = set(rule1breaks.keys()) | rule2breaks
-        if init in pruneTargets:
-            return set()
-        pruneResult -= pruneTargets
-        
-        # find out which vertices may now become an issue
-        newlyExposedVerts : set[VertId] = set()
-        for v in pruneTargets:
-            newlyExposedVerts |= incEdges[v]
-        (rule1breaks, rule2breaks) = find_problems_on_specified_verts(game, pruneResult, newlyExposedVerts)
-
-    return pruneResult
-
 def export_subgame_config(game: Game, subgameconf: set[VertId], destfile: str):
-    #print("subgameconf: " + str(subgameconf) + "\n\n")
-    subgame = realise_subgame(game, subgameconf)
-    #print("subgame:\n" + str(subgame) + "\n\n")
-    subgame = flatten_game(subgame)
-    #print("flattened subgame:\n" + str(subgame) + "\n\n")
-    
-    #(vertices, init, priority, owned, outEdges, incEdges) = game
-    #print("parent outEdges:")
-    #for v in outEdges.keys():
-        #print(str(v) + ": " + str(outEdges[v]))
-    export_to_file(subgame, destfile)
+    export_to_file(SubgameView(game, subgameconf), destfile)
 
 
 def main_func():
-    if args.soldomacc:
-        parse_findsolution_export_sol_domain_accelerated()
-    else:
-        parse_findsolution_export()
+    cache = None if args.nocache else args.cache
+    with make_cached_backend(make_backend(args.solver, args.jobs, processes=args.multithreaded), cache, args.cachesize, args.solver) as backend:
+        if args.soldomacc:
+            parse_findsolution_export_sol_domain_accelerated(backend)
+        else:
+            parse_findsolution_export(backend)
         
 
 
@@ -203,15 +186,24 @@ parser = argparse.ArgumentParser(
 parser.add_argument('inputfile')
 parser.add_argument('outputfolder')
 parser.add_argument('-algo', '--algorithm', default = 'SDSI')
-parser.add_argument('-sv', '--initialvertex', default=0)
+parser.add_argument('-sv', '--initialvertex', type=int, help='search from this vertex instead of the initial vertex of the game')
 parser.add_argument('-p', '--profile', action='store_true')
+parser.add_argument('-po', '--profileout', help='write the profile to this pstats file instead of printing it')
+parser.add_argument('-m', '--metrics', help='append the phase timings and counters of the run to this JSON lines file')
 parser.add_argument('-mt', '--multithreaded', action='store_true')
 parser.add_argument('-opf', '--optimizedproblemfinder', action='store_true')
+parser.add_argument('-solver', '--solver', choices=['oink', 'zielonka'], default='oink')
+parser.add_argument('-j', '--jobs', type=int)
+parser.add_argument('-cache', '--cache', default=DEFAULT_CACHE_PATH)
+parser.add_argument('-cachesize', '--cachesize', type=int, default=256)
+parser.add_argument('-nocache', '--nocache', action='store_true')
+parser.add_argument('-reduce', '--reduce', action='store_true', help='search on the reduced game, the result keeps the ids of the input game')
 parser.add_argument('-sda', '--soldomacc', action='store_true')
+parser.add_argument('-checkpoint', '--checkpoint', help='keep the search state in this file and resume from it, it is also written on SIGTERM and SIGINT')
+parser.add_argument('-checkpointevery', '--checkpointevery', type=float, default=60, help='seconds between checkpoints')
 
 args = parser.parse_args()
 
-if (args.profile):
-    cProfile.run("main_func()")
-else:
-    main_func()
\ No newline at end of file
+# worker processes that import this file must not start a search of their own
+if __name__ == '__main__':
+    metrics.run(main_func, args.profile, args.profileout, args.metrics)
\ No newline at end of file
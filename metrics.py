@@ -0,0 +1,133 @@
+"""
+Phase timers and event counters of a run. Updating them costs a lock and a dict update,
+so they are always on. Worker processes keep their own and send what they measured back
+with every result, the main process merges it and reports the total.
+"""
+from typing import Any, Callable
+import cProfile
+import functools
+import json
+import sys
+import threading
+import time
+
+
+class Metrics:
+    __slots__ = ('lock', 'seconds', 'calls', 'counters')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds: dict[str, float] = dict()
+        self.calls: dict[str, int] = dict()
+        self.counters: dict[str, int] = dict()
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        with self.lock:
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+            self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> dict[str, Any]:
+        with self.lock:
+            return {"seconds": {phase: round(s, 6) for (phase, s) in self.seconds.items()},
+                    "calls": dict(self.calls), "counters": dict(self.counters)}
+
+    def take(self) -> dict[str, Any]:
+        """
+        Returns what was measured since the last take and starts over, for a worker to send along.
+        """
+        with self.lock:
+            delta = {"seconds": self.seconds, "calls": self.calls, "counters": self.counters}
+            self.seconds = dict()
+            self.calls = dict()
+            self.counters = dict()
+        return delta
+
+    def merge(self, delta: dict[str, Any]) -> None:
+        with self.lock:
+            for (phase, s) in delta["seconds"].items():
+                self.seconds[phase] = self.seconds.get(phase, 0.0) + s
+            for (phase, n) in delta["calls"].items():
+                self.calls[phase] = self.calls.get(phase, 0) + n
+            for (name, n) in delta["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self) -> str:
+        with self.lock:
+            lines = [f"{phase:16} {self.seconds[phase]:10.3f}s {self.calls[phase]:10} calls" for phase in self.seconds]
+            lines += [f"{name:28} {n:10}" for (name, n) in self.counters.items()]
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.seconds.clear()
+            self.calls.clear()
+            self.counters.clear()
+
+METRICS = Metrics()
+
+
+class PhaseTimer:
+    __slots__ = ('phase', 'start')
+
+    def __init__(self, phase: str):
+        self.phase = phase
+
+    def __enter__(self) -> 'PhaseTimer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        METRICS.add_time(self.phase, time.perf_counter() - self.start)
+
+def timer(phase: str) -> PhaseTimer:
+    """
+    with timer("prune"): adds the time spent in the block to the prune phase.
+    """
+    return PhaseTimer(phase)
+
+def count(name: str, n: int = 1) -> None:
+    METRICS.count(name, n)
+
+def timed(phase: str) -> Callable[[Callable], Callable]:
+    """
+    Decorator that adds every call of the function to phase.
+    """
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with PhaseTimer(phase):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def write_jsonl(filename: str, **info: Any) -> None:
+    """
+    Appends the metrics of this run as one JSON line, together with info.
+    """
+    record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "argv": sys.argv, **info, **METRICS.snapshot()}
+    with open(filename, "a") as file:
+        file.write(json.dumps(record) + "\n")
+
+def run(fn: Callable[[], Any], profile: bool = False, profileFile: str | None = None, metricsFile: str | None = None) -> None:
+    """
+    Runs the main function of a driver. With profile it runs under cProfile and the statistics
+    are written to profileFile (for pstats or snakeviz) or printed, followed by a metrics summary.
+    metricsFile gets the metrics as a JSON line.
+    """
+    if profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(fn)
+        if profileFile is not None:
+            profiler.dump_stats(profileFile)
+        else:
+            profiler.print_stats()
+        print(METRICS.report())
+    else:
+        fn()
+    if metricsFile is not None:
+        write_jsonl(metricsFile)
@@ -3,7 +3,7 @@ cd ~/testdata/examples
 for file in *
     #do echo "$file"
     do
-    timeout 100s python3 ~/kraam/kraam_local_optimum.py ~/testdata/examples/"$file" ~/testdata/local_optimum/"$file"
-    #timeout 10s python3 ~/kraam/kraam_local_optimum.py ~/testdata/examples/"$file" ~/testdata/local_optimum_sda/"$file" -sda
+    timeout 100s python3 ~/kraam/kraam_local_optimum.py ~/testdata/examples/"$file" ~/testdata/local_optimum/"$file" -checkpoint ~/testdata/local_optimum/"$file".checkpoint
+    #timeout 10s python3 ~/kraam/kraam_local_optimum.py ~/testdata/examples/"$file" ~/testdata/local_optimum_sda/"$file" -sda -checkpoint ~/testdata/local_optimum_sda/"$file".checkpoint
 
 done
\ No newline at end of file
@@ -0,0 +1,425 @@
+from typing import Iterable, Iterator
+from game import BitSet, Game, VertId, VertexSet, members
+import metrics
+
+
+class LayeredPruner:
+    """
+    Pruning state of a vertex set that only grows, like the reach of an SDSI search.
+    For every member it keeps the number of successors inside and outside the set, the
+    members that break rule 1 or rule 2 on their own (violations), the members that pruning
+    removes and, for the owned members that stay, the number of removed successors (lost).
+    Adding vertices only touches the new vertices and their edges. Pruning only decides the
+    vertices added since the last prune, with the removed vertices that lead to them.
+    """
+    __slots__ = ('game', 'members', 'inside', 'outside', 'violations', 'removed', 'lost', 'fresh', 'stale',
+                 'wasted')
+
+    def __init__(self, game: Game, members: Iterable[VertId] = ()):
+        self.game = game
+        self.members: set[VertId] = set()
+        self.inside: dict[VertId, int] = dict()
+        self.outside: dict[VertId, int] = dict()
+        self.violations: set[VertId] = set()
+        self.removed: set[VertId] = set()
+        self.lost: dict[VertId, int] = dict()
+        self.fresh: list[VertId] = []
+        # removed and lost are only partly worked out, the next prune has to start over
+        self.stale = False
+        # vertices removed by rebuilds that stopped at keep since the last complete one
+        self.wasted = 0
+        self.add(members)
+
+    def check(self, v: VertId) -> None:
+        if self.game.owner[v] == 0:
+            broken = self.inside[v] == 0
+        else:
+            broken = self.outside[v] != 0
+        if broken:
+            self.violations.add(v)
+        else:
+            self.violations.discard(v)
+
+    def add(self, vertices: Iterable[VertId]) -> None:
+        game = self.game
+        members = self.members
+        inside = self.inside
+        outside = self.outside
+        newVertices = {v for v in vertices if v not in members}
+        members |= newVertices
+        self.fresh.extend(newVertices)
+        for w in newVertices:
+            dests = game.successors(w)
+            count = sum(1 for x in dests if x in members)
+            inside[w] = count
+            outside[w] = len(dests) - count
+            self.check(w)
+            # older members gain an internal edge
+            for v in game.predecessors(w):
+                if v in members and v not in newVertices:
+                    inside[v] += 1
+                    outside[v] -= 1
+                    self.check(v)
+
+    @metrics.timed("prune")
+    def prune(self, keep: VertId | None = None) -> set[VertId]:
+        """
+        Returns the largest valid subgame within the members.
+        If keep is given and is pruned, the empty set is returned.
+        A removed vertex can only come back through a path of removed vertices to a new vertex
+        that does not break a rule on its own. These candidates are taken back and pruned again,
+        when they are a large part of the removed vertices everything is pruned from scratch.
+        """
+        game = self.game
+        owner = game.owner
+        incStart = game.incStart
+        incTargets = game.incTargets
+        members = self.members
+        inside = self.inside
+        removed = self.removed
+        lost = self.lost
+        violations = self.violations
+        fresh = self.fresh
+        self.fresh = []
+        metrics.count("prune iterations")
+        if self.stale:
+            return self.rebuild(keep)
+
+        # new violations lose their owned predecessors a successor, the opponent ones
+        # already had an edge out of the members and are removed
+        candidates: set[VertId] = set()
+        for w in fresh:
+            if w not in violations:
+                candidates.add(w)
+                continue
+            removed.add(w)
+            for v in incTargets[incStart[w]:incStart[w + 1]]:
+                if v in members and owner[v] == 0:
+                    lost[v] = lost.get(v, 0) + 1
+        if len(removed) == 0:
+            # no member lost a successor, like when the members are a valid subgame
+            lost.clear()
+            return self.remaining(keep)
+        budget = len(candidates) + len(removed) // 16
+        stack = list(candidates)
+        while len(stack) != 0:
+            if len(candidates) > budget:
+                return self.rebuild(keep)
+            w = stack.pop()
+            for v in incTargets[incStart[w]:incStart[w + 1]]:
+                if v not in members:
+                    continue
+                if v in removed:
+                    if v not in candidates and v not in violations:
+                        candidates.add(v)
+                        stack.append(v)
+                elif owner[v] == 0 and w in removed and v not in candidates:
+                    # an older member that gets a removed successor back
+                    lost[v] -= 1
+
+        removed -= candidates
+        queue = []
+        for v in candidates:
+            dests = game.successors(v)
+            if owner[v] != 0:
+                # candidates are no violations, so all successors are members
+                if any(x in removed for x in dests):
+                    queue.append(v)
+                continue
+            lost[v] = sum(1 for x in dests if x in removed)
+            if lost[v] == inside[v]:
+                queue.append(v)
+        removed.update(queue)
+        spread_removal(game, members, removed, inside, lost, queue)
+        return self.remaining(keep)
+
+    def rebuild(self, keep: VertId | None) -> set[VertId]:
+        """
+        prune from scratch. Like the prune function it stops as soon as keep has to go, the next
+        prune then starts from scratch again. Once the rebuilds that stopped early removed as many
+        vertices as there are members, one runs to the end so the layers after it can be pruned
+        incrementally again. That costs at most as much as the early stops did.
+        """
+        stop = keep if self.wasted < len(self.members) else None
+        removed = self.removed = set(self.violations)
+        self.lost = dict()
+        self.stale = stop in removed or not spread_removal(self.game, self.members, removed, self.inside, self.lost, list(removed), stop)
+        if self.stale:
+            self.wasted += len(removed)
+            return set()
+        self.wasted = 0
+        return self.remaining(keep)
+
+    def remaining(self, keep: VertId | None) -> set[VertId]:
+        if keep in self.removed:
+            return set()
+        metrics.count("vertices removed", len(self.removed))
+        return self.members - self.removed
+
+
+def spread_removal(game: Game, members: set[VertId], removed: set[VertId], inside: dict[VertId, int],
+                   lost: dict[VertId, int], queue: list[VertId], keep: VertId | None = None) -> bool:
+    """
+    Extends removed, a subset of members, with every member that has to go once the removed
+    vertices in queue are gone: opponent vertices with an edge into them and owned vertices
+    with all their internal edges into them. lost holds the number of removed successors of
+    the owned members that stay and is kept up to date, inside is not modified.
+    Every removed vertex is taken from the worklist once, so this runs in O(V+E).
+    Returns False as soon as keep has to be removed.
+    """
+    owner = game.owner
+    incStart = game.incStart
+    incTargets = game.incTargets
+    while len(queue) != 0:
+        w = queue.pop()
+        for v in incTargets[incStart[w]:incStart[w + 1]]:
+            if v in removed or v not in members:
+                continue
+            if owner[v] == 0:
+                # owned vertices survive as long as one internal edge is left
+                count = lost.get(v, 0) + 1
+                lost[v] = count
+                if count < inside[v]:
+                    continue
+            if v == keep:
+                return False
+            removed.add(v)
+            queue.append(v)
+
+    return True
+
+
+def remove_closure(game: Game, members: set[VertId], removed: set[VertId], inside: dict[VertId, int],
+                   keep: VertId | None = None) -> bool:
+    """
+    Extends removed, a subset of members, with every member that has to go once removed is gone.
+    inside holds the number of successors within members of the owned members, it is not modified.
+    Returns False as soon as keep has to be removed.
+    """
+    return spread_removal(game, members, removed, inside, dict(), list(removed), keep)
+
+
+@metrics.timed("prune")
+def prune(game: Game, cVertices: VertexSet, keep: VertId | None = None) -> set[VertId]:
+    """
+    Returns the largest valid subgame within cVertices, the same fixpoint that repeated
+    find_problems calls reach, in one pass over the vertices and edges of cVertices.
+    If keep is given and would be pruned, the empty set is returned.
+    """
+    cVertices = members(cVertices)
+    owner = game.owner
+    outStart = game.outStart
+    outTargets = game.outTargets
+
+    inside: dict[VertId, int] = dict()
+    removed: set[VertId] = set()
+    for v in cVertices:
+        dests = outTargets[outStart[v]:outStart[v + 1]]
+        if owner[v] == 0:
+            count = sum(1 for x in dests if x in cVertices)
+            if count == 0:
+                removed.add(v)
+            inside[v] = count
+        elif not all(x in cVertices for x in dests):
+            removed.add(v)
+
+    metrics.count("prune iterations")
+    if keep in removed or not remove_closure(game, cVertices, removed, inside, keep):
+        return set()
+    metrics.count("vertices removed", len(removed))
+    return cVertices - removed
+
+
+class DeltaPruner:
+    """
+    Removal state of a subgame sg that is kept while many vertex sets are taken out of it:
+    the pruned subgame itself and the number of internal successors of its owned vertices.
+    Removing vertices only walks the predecessors of what the removal takes along, so a
+    neighbour of sg costs the size of its cascade instead of the size of sg.
+    base is what sg loses to pruning on its own, nothing for a valid subgame.
+    """
+    __slots__ = ('game', 'keep', 'members', 'base', 'inside', 'cascades')
+
+    def __init__(self, game: Game, sg: VertexSet, keep: VertId | None = None):
+        self.game = game
+        self.keep = keep
+        sgMembers = members(sg)
+        self.members: set[VertId] = prune(game, sgMembers)
+        self.base: frozenset[VertId] = frozenset(sgMembers - self.members)
+        owner = game.owner
+        self.inside: dict[VertId, int] = {v: sum(1 for w in game.successors(v) if w in self.members)
+                                          for v in self.members if owner[v] == 0}
+        self.cascades: dict[VertId, frozenset[VertId] | None] = dict()
+
+    @metrics.timed("prune")
+    def remove(self, vertices: Iterable[VertId]) -> frozenset[VertId] | None:
+        """
+        Every member that has to go when vertices are removed, those included.
+        None if keep would have to go.
+        """
+        removed = {v for v in vertices if v in self.members}
+        metrics.count("prune iterations")
+        if self.keep in self.base or self.keep in removed:
+            return None
+        if not remove_closure(self.game, self.members, removed, self.inside, self.keep):
+            return None
+        metrics.count("vertices removed", len(removed))
+        return frozenset(removed)
+
+    def cascade(self, v: VertId) -> frozenset[VertId] | None:
+        """
+        remove for the single vertex v, memoized.
+        """
+        if v not in self.cascades:
+            self.cascades[v] = self.remove((v,))
+        return self.cascades[v]
+
+    def repair(self, vertices: Iterable[VertId]) -> set[VertId]:
+        """
+        The largest valid subgame within sg without vertices, the empty set if keep would be pruned.
+        """
+        removed = self.remove(vertices)
+        return set() if removed is None else self.members - removed
+
+
+def prune_neighbours(game: Game, sg: frozenset[VertId] | BitSet, removals: list[VertId], keep: VertId | None = None) -> list[frozenset[VertId] | BitSet]:
+    """
+    Prunes sg without v for every v in removals. Returns what each of these neighbours
+    loses compared to sg (v included), which is usually much smaller than the neighbour.
+    The losses are bitsets when sg is one. Every neighbour only costs its own cascade.
+    """
+    kind = BitSet if isinstance(sg, BitSet) else frozenset
+    pruner = DeltaPruner(game, sg, keep)
+    losses = []
+    for v in removals:
+        cascade = pruner.cascade(v)
+        losses.append(sg if cascade is None else kind(pruner.base | cascade))
+    return losses
+
+
+# enumeration states of a vertex, undecided vertices are 0
+IN = 1
+OUT = 2
+
+def valid_subgames(game: Game, size: int, keep: VertId, shard: int = 0, shards: int = 1) -> Iterator[tuple[int, set[VertId]]]:
+    """
+    Yields every valid subgame with exactly size vertices that contains keep, each one once.
+    Branches on including or excluding one vertex at a time and propagates the rules right away:
+    an included opponent vertex pulls in all its successors and an included owned vertex its
+    last remaining one, excluded vertices rule out their opponent predecessors. Branches that
+    cannot reach size vertices are cut. Memory use is linear in the size of the game.
+    For shards > 1 the branches at a fixed depth are dealt round robin over the shards,
+    together the shards yield every subgame exactly once. Every subgame comes with the ticket
+    of the branch it was dealt in (0 without shards), tickets and the order within a shard
+    follow the order of the enumeration without shards.
+    """
+    owner = game.owner
+    order = sorted(game.vertices)
+    state = bytearray(game.num_ids())
+    for v in range(len(state)):
+        if v not in game.vertices:
+            state[v] = OUT
+    trail: list[VertId] = []
+    members: list[VertId] = []
+    undecided = len(order)
+
+    def assign(v: VertId, s: int, queue: list[VertId]) -> None:
+        nonlocal undecided
+        state[v] = s
+        trail.append(v)
+        undecided -= 1
+        if s == IN:
+            members.append(v)
+        queue.append(v)
+
+    def support(u: VertId, queue: list[VertId]) -> bool:
+        # an owned member needs one successor that is not excluded, the last one is forced in
+        candidate = None
+        for w in game.successors(u):
+            if state[w] == IN:
+                return True
+            if state[w] == 0:
+                if candidate is not None:
+                    return True
+                candidate = w
+        if candidate is None:
+            return False
+        assign(candidate, IN, queue)
+        return True
+
+    def propagate(queue: list[VertId]) -> bool:
+        while len(queue) != 0:
+            v = queue.pop()
+            if state[v] == IN:
+                if len(members) > size:
+                    return False
+                if owner[v] == 0:
+                    if not support(v, queue):
+                        return False
+                    continue
+                for w in game.successors(v):
+                    if state[w] == OUT:
+                        return False
+                    if state[w] == 0:
+                        assign(w, IN, queue)
+            else:
+                for u in game.predecessors(v):
+                    if state[u] == IN and (owner[u] != 0 or not support(u, queue)):
+                        return False
+        return len(members) + undecided >= size
+
+    def undo(mark: int) -> None:
+        nonlocal undecided
+        while len(trail) > mark:
+            v = trail.pop()
+            if state[v] == IN:
+                members.pop()
+            state[v] = 0
+            undecided += 1
+
+    def branch_vertex() -> VertId | None:
+        # None when the members are a valid subgame of the right size, -1 when nothing is left to try
+        for u in members:
+            if owner[u] == 0 and all(state[w] != IN for w in game.successors(u)):
+                return next(w for w in game.successors(u) if state[w] == 0)
+        if len(members) == size:
+            return None
+        return next((v for v in order if state[v] == 0), VertId(-1))
+
+    queue: list[VertId] = []
+    assign(keep, IN, queue)
+    if not propagate(queue):
+        return
+    split = shards.bit_length() + 3
+    ticket = 0
+    dealt = 0
+    pending: list[tuple[int, VertId, int]] = []
+    depth = 0
+    while True:
+        w = branch_vertex()
+        if shards > 1 and (depth == split or (depth < split and w is None)):
+            if ticket % shards != shard:
+                w = VertId(-1)
+            dealt = ticket
+            ticket += 1
+        if w is None:
+            metrics.count("candidates generated")
+            yield (dealt, set(members))
+        elif w != -1:
+            pending.append((len(trail), w, depth + 1))
+            queue = []
+            assign(w, IN, queue)
+            if propagate(queue):
+                depth += 1
+                continue
+
+        # take the exclude branch of the deepest open decision that is still consistent
+        while len(pending) != 0:
+            (mark, w, depth) = pending.pop()
+            undo(mark)
+            queue = []
+            assign(w, OUT, queue)
+            if propagate(queue):
+                break
+        else:
+            return
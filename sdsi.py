@@ -1,5 +1,13 @@
-from game import Game, VertId, Priority
-from game import is_valid_subgame, find_problems, find_problems_on_specified_verts
+from game import Game, VertId, Priority, export_subgame, with_init
+from game import is_valid_subgame
+from pruning import LayeredPruner, prune
+from metrics import timed
+from solver import Solution, SolverBackend, export_solution
+from collections import deque
+from concurrent.futures import Future
+from typing import Iterator
+import solver
+import os
 
 
 class SDSI:
@@ -7,50 +15,159 @@ class SDSI:
         self.game : Game = game
         self.start : VertId = start
         self.size : int = 1 # add 1 because the starting vertex is added by default
-        self.reach : set[VertId] = {start}
+        # the pruner owns the reach, it keeps the pruning state up to date while the reach grows
+        self.pruner : LayeredPruner = LayeredPruner(game, {start})
+        self.reach : set[VertId] = self.pruner.members
+        # the vertices added by the last layer, only their neighbours can be new
+        self.frontier : set[VertId] = {start}
 
+    @timed("expand")
     def increase_reach(self, times: int) -> bool:
         increased: bool = False
-        (pVertices, pInit, pPriority, pOwned, pOutEdges, pIncEdges) = self.game
         for i in range(times):
-            nextReach: set[VertId] = set()
-            for v in self.reach:
-                nextReach = nextReach | pOutEdges[v]
+            nextFrontier: set[VertId] = set()
+            for v in self.frontier:
+                nextFrontier.update(self.game.successors(v))
+            nextFrontier -= self.reach
             
-            if len(nextReach - self.reach) != 0:
+            if len(nextFrontier) != 0:
                 increased = True
-            self.reach = self.reach | nextReach
+            self.pruner.add(nextFrontier)
+            self.frontier = nextFrontier
             self.size += 1
         
         return increased
             
     def prune(self) -> set[VertId] :
-        pruneResult = self.reach.copy()
-        (rule1breaks, rule2breaks) = find_problems(self.game, pruneResult)
-        while not (len(rule1breaks) == 0 and len(rule2breaks) == 0):
-            pruneResult -= set(rule1breaks.keys())
-            pruneResult -= rule2breaks
-            (rule1breaks, rule2breaks) = find_problems(self.game, pruneResult)
-
-        return pruneResult
+        return self.pruner.prune()
     
     def prune_subset_optimized(self) -> set[VertId] :
-        (_, init, _, _, _, incEdges) = self.game
-        
-        pruneResult = self.reach.copy()
-        
-        (rule1breaks, rule2breaks) = find_problems(self.game, pruneResult)
-        while not (len(rule1breaks) == 0 and len(rule2breaks) == 0):
-            pruneTargets = set(rule1breaks.keys()) | rule2breaks
-            if init in pruneTargets:
-                return set()
-            pruneResult -= pruneTargets
-            
-            # find out which vertices may now become an issue
-            newlyExposedVerts : set[VertId] = set()
-            for v in pruneTargets:
-                newlyExposedVerts |= incEdges[v]
-            (rule1breaks, rule2breaks) = find_problems_on_specified_verts(self.game, pruneResult, newlyExposedVerts)
-
-        return pruneResult
-    
\ No newline at end of file
+        # returns the empty set as soon as the initial vertex would be pruned
+        return self.pruner.prune(self.game.init)
+
+
+def solve_layers(game: Game, algo_to_use, backend: SolverBackend) -> Iterator[tuple[int, set[VertId], Solution]]:
+    """
+    Grows the reach of algo_to_use (SDSI or one of its variants) one layer at a time and solves
+    the pruned subgame of every layer, up to the layer that prunes to the whole game.
+    The search starts at the initial vertex of game.
+    Yields the layer number, the pruned subgame and its solution.
+    """
+    parentlen = len(game.vertices)
+    algo = algo_to_use(game, game.init)
+    algo.prune()
+    size = 1
+    while algo.increase_reach(1):
+        size += 1
+        subgameconf = algo.prune_subset_optimized()
+        if len(subgameconf) <= 1:
+            continue
+
+        yield (size, subgameconf, backend.solve(game, subgameconf))
+        if len(subgameconf) == parentlen:
+            return
+
+
+def pipelined_layers(game: Game, algo_to_use, backend: SolverBackend, ahead: int | None = None) -> tuple[int, set[VertId], Solution] | None:
+    """
+    The first layer of solve_layers that player 0 wins, with the next layers expanded, pruned and
+    submitted while the earlier ones are solved: at most ahead solves (backend.jobs + 1 by default)
+    are outstanding. The layers are decided in order, so the result is that of the linear scan.
+    Once a layer is won, the solves that did not start yet are cancelled and the others discarded.
+    """
+    ahead = ahead or backend.jobs + 1
+    parentlen = len(game.vertices)
+    algo = algo_to_use(game, game.init)
+    pending: deque[tuple[int, set[VertId], Future]] = deque()
+    size = 1
+    growing = True
+    while True:
+        while growing and len(pending) < ahead:
+            growing = algo.increase_reach(1)
+            if not growing:
+                break
+            size += 1
+            subgameconf = algo.prune_subset_optimized()
+            if len(subgameconf) <= 1:
+                continue
+            pending.append((size, subgameconf, backend.submit(game, subgameconf)))
+            # no layer after the whole game is solved
+            growing = len(subgameconf) != parentlen
+        if len(pending) == 0:
+            return None
+        (layer, subgameconf, future) = pending.popleft()
+        solution = future.result()
+        if solution.winner == 0:
+            for (_, _, later) in pending:
+                later.cancel()
+            return (layer, subgameconf, solution)
+
+def won_layer(game: Game, subgameconf: set[VertId], backend: SolverBackend) -> Solution | None:
+    # layers that solve_layers skips count as lost
+    if len(subgameconf) <= 1:
+        return None
+    solution = backend.solve(game, subgameconf)
+    return solution if solution.winner == 0 else None
+
+def gallop_layers(game: Game, algo_to_use, backend: SolverBackend) -> tuple[int, set[VertId], Solution] | None:
+    """
+    Finds the first layer of solve_layers that player 0 wins with O(log depth) solves.
+    The pruned layers are nested and player 1 cannot leave them, so once player 0 wins a layer
+    it wins every deeper one: the depth is doubled until a layer is won and the smallest won
+    layer is then found by bisection. The reach is stored per layer, stepping back only prunes
+    the union of the layers again.
+    Returns the layer number, the pruned subgame and its solution, or None if no layer is won.
+    """
+    parentlen = len(game.vertices)
+    algo = algo_to_use(game, game.init)
+    # frontiers[i] holds the vertices first reached in layer i + 1
+    frontiers: list[set[VertId]] = [set(algo.reach)]
+    lost = 1
+    size = 1
+    while True:
+        target = 2 * size
+        while size < target and algo.increase_reach(1):
+            size += 1
+            frontiers.append(algo.frontier)
+        if size == lost:
+            # the reach stopped growing before the last layer that was lost
+            return None
+        subgameconf = algo.prune_subset_optimized()
+        solution = won_layer(game, subgameconf, backend)
+        if solution is not None:
+            break
+        if len(subgameconf) == parentlen or size < target:
+            return None
+        lost = size
+
+    (won, wonconf, wonsolution) = (size, subgameconf, solution)
+    while won - lost > 1:
+        middle = (lost + won) // 2
+        subgameconf = prune(game, set().union(*frontiers[:middle]), game.init)
+        solution = won_layer(game, subgameconf, backend)
+        if solution is None:
+            lost = middle
+        else:
+            (won, wonconf, wonsolution) = (middle, subgameconf, solution)
+    return (won, wonconf, wonsolution)
+
+
+def worker_search(game: Game, start: VertId, algo_to_use, destfolder: str, galloping: bool = False) -> tuple[int, int, int] | None:
+    """
+    Runs on a solver worker process: solves the layers around start until player 0 wins one and
+    writes that subgame and its solution to destfolder.
+    Returns the layer, the size of the subgame and the size of the solution domain.
+    """
+    game = with_init(game, start)
+    if galloping:
+        found = gallop_layers(game, algo_to_use, solver.worker_backend)
+    else:
+        found = next(((size, subgameconf, solution) for (size, subgameconf, solution)
+                      in solve_layers(game, algo_to_use, solver.worker_backend) if solution.winner == 0), None)
+    if found is None:
+        return None
+    (size, subgameconf, solution) = found
+    os.makedirs(destfolder, exist_ok=True)
+    export_subgame(game, subgameconf, os.path.join(destfolder, "subgame.pg"))
+    export_solution(game, solution, os.path.join(destfolder, "subgame.pg.sol"))
+    return (size, len(subgameconf), len(solution.domain))
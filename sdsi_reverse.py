@@ -1,5 +1,7 @@
 from game import Game, VertId, Priority
-from game import is_valid_subgame, find_problems, find_problems_on_specified_verts
+from game import is_valid_subgame
+from pruning import LayeredPruner
+from metrics import timed
 
 
 class SDSI_reverse:
@@ -7,50 +9,32 @@ class SDSI_reverse:
         self.game : Game = game
         self.start : VertId = start
         self.size : int = 1 # add 1 because the starting vertex is added by default
-        self.reach : set[VertId] = {start}
+        # the pruner owns the reach, it keeps the pruning state up to date while the reach grows
+        self.pruner : LayeredPruner = LayeredPruner(game, {start})
+        self.reach : set[VertId] = self.pruner.members
+        # the vertices added by the last layer, only their neighbours can be new
+        self.frontier : set[VertId] = {start}
 
+    @timed("expand")
     def increase_reach(self, times: int) -> bool:
         increased: bool = False
-        (pVertices, pInit, pPriority, pOwned, pOutEdges, pIncEdges) = self.game
         for i in range(times):
-            nextReach: set[VertId] = set()
-            for v in self.reach:
-                nextReach = nextReach | pIncEdges[v]
+            nextFrontier: set[VertId] = set()
+            for v in self.frontier:
+                nextFrontier.update(self.game.predecessors(v))
+            nextFrontier -= self.reach
             
-            if len(nextReach - self.reach) != 0:
+            if len(nextFrontier) != 0:
                 increased = True
-            self.reach = self.reach | nextReach
+            self.pruner.add(nextFrontier)
+            self.frontier = nextFrontier
             self.size += 1
         
         return increased
             
     def prune(self) -> set[VertId] :
-        pruneResult = self.reach.copy()
-        (rule1breaks, rule2breaks) = find_problems(self.game, pruneResult)
-        while not (len(rule1breaks) == 0 and len(rule2breaks) == 0):
-            pruneResult -= set(rule1breaks.keys())
-            pruneResult -= rule2breaks
-            (rule1breaks, rule2breaks) = find_problems(self.game, pruneResult)
-
-        return pruneResult
+        return self.pruner.prune()
     
     def prune_subset_optimized(self) -> set[VertId] :
-        (_, init, _, _, _, incEdges) = self.game
-        
-        pruneResult = self.reach.copy()
-        
-        (rule1breaks, rule2breaks) = find_problems(self.game, pruneResult)
-        while not (len(rule1breaks) == 0 and len(rule2breaks) == 0):
-            pruneTargets = set(rule1breaks.keys()) | rule2breaks
-            if init in pruneTargets:
-                return set()
-            pruneResult -= pruneTargets
-            
-            # find out which vertices may now become an issue
-            newlyExposedVerts : set[VertId] = set()
-            for v in pruneTargets:
-                newlyExposedVerts |= incEdges[v]
-            (rule1breaks, rule2breaks) = find_problems_on_specified_verts(self.game, pruneResult, newlyExposedVerts)
-
-        return pruneResult
-    
\ No newline at end of file
+        # returns the empty set as soon as the initial vertex would be pruned
+        return self.pruner.prune(self.game.init)
@@ -0,0 +1,77 @@
+"""
+A parsed game published in shared memory. Worker processes attach to it as a read-only game
+whose arrays are views on the shared block, so the game is neither pickled nor copied per worker.
+"""
+from array import array
+from multiprocessing import shared_memory
+from game import Game, VertId, ID_TYPE, OFFSET_TYPE, PRIORITY_TYPE, OWNER_TYPE
+
+# (attribute, typecode) in the order of the block, the wide arrays first so that all stay aligned
+LAYOUT = (('outStart', OFFSET_TYPE), ('incStart', OFFSET_TYPE), ('priority', PRIORITY_TYPE),
+          ('outTargets', ID_TYPE), ('incTargets', ID_TYPE), ('owner', OWNER_TYPE))
+ALIGNMENT = 8
+
+
+class GameHandle:
+    """
+    What a worker needs to attach to a SharedGame: the name of the block and the lengths of the
+    arrays in it. The vertices travel along, a range pickles to a few bytes.
+    """
+    __slots__ = ('name', 'vertices', 'init', 'lengths')
+
+    def __init__(self, name: str, vertices: range | frozenset[VertId], init: VertId, lengths: tuple[int, ...]):
+        self.name = name
+        self.vertices = vertices
+        self.init = init
+        self.lengths = lengths
+
+
+def block_offsets(lengths: tuple[int, ...]) -> list[int]:
+    offsets = [0]
+    for ((_, typecode), length) in zip(LAYOUT, lengths):
+        size = length * array(typecode).itemsize
+        offsets.append(offsets[-1] + -(-size // ALIGNMENT) * ALIGNMENT)
+    return offsets
+
+
+class SharedGame:
+    """
+    Owner of the shared memory block of a game, the arrays are copied into it once.
+    close (or leaving the with block) frees the block, attached workers have to be done by then.
+    """
+    __slots__ = ('memory', 'handle')
+
+    def __init__(self, game: Game):
+        arrays = [getattr(game, attribute) for (attribute, _) in LAYOUT]
+        lengths = tuple(map(len, arrays))
+        offsets = block_offsets(lengths)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(offsets[-1], 1))
+        for (part, start) in zip(arrays, offsets):
+            data = memoryview(part).cast('B')
+            self.memory.buf[start:start + len(data)] = data
+        self.handle = GameHandle(self.memory.name, game.vertices, game.init, lengths)
+
+    def close(self) -> None:
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self) -> 'SharedGame':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def attach_game(handle: GameHandle) -> tuple[Game, shared_memory.SharedMemory]:
+    """
+    The game published under handle, its arrays are read-only memoryviews on the shared block.
+    The block stays mapped as long as the returned SharedMemory is kept.
+    """
+    memory = shared_memory.SharedMemory(handle.name)
+    offsets = block_offsets(handle.lengths)
+    buffer = memory.buf.toreadonly()
+    views = {attribute: buffer[start:start + length * array(typecode).itemsize].cast(typecode)
+             for ((attribute, typecode), start, length) in zip(LAYOUT, offsets, handle.lengths)}
+    game = Game(handle.vertices, handle.init, views['priority'], views['owner'],
+                views['outStart'], views['outTargets'], views['incStart'], views['incTargets'])
+    return (game, memory)
@@ -1,4 +1,4 @@
-from game import Game, VertId, parse_game, parse_solution, solution_size
+from game import Game, VertId, open_game_file, parse_game, parse_solution, solution_size
 
 import argparse
 parser = argparse.ArgumentParser(
@@ -13,8 +13,9 @@ args = parser.parse_args()
 filename: str = args.gamefile.split("/")[-1]
 
 
-gamefile = open(args.gamefile, "r")
-parity = int(gamefile.readline().strip("\n\r; ").split()[1])
+gamefile = open_game_file(args.gamefile)
+parity = int(gamefile.readline().strip(b"\n\r; ").split()[1])
+gamefile.close()
 
 game: Game = parse_game(args.gamefile)
 solution: dict[VertId, VertId] = parse_solution(args.solfile)
@@ -0,0 +1,400 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.util import Finalize
+from typing import Any, Callable, Iterable, Sequence
+from game import Game, SubgameView, VertId, compress_priorities, export_to_file, flat_order, read_game_file, solution_domain
+from pruning import valid_subgames
+from shared import GameHandle, SharedGame, attach_game
+from metrics import METRICS, count, timed, timer
+import itertools
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+
+
+class Solution:
+    """
+    Solution of a (sub)game, all vertex ids are those of the parent game.
+    won[i] is the winning region of player i, strategy holds the player 0 strategy on won[0].
+    winner is the winner of the vertex that oink would report first: the initial vertex
+    if it is part of the subgame. domain is the solution domain of the strategy within won[0],
+    worked out on first use, and empty when player 0 loses.
+    """
+    __slots__ = ('game', 'winner', 'won', 'strategy', 'knownDomain')
+
+    def __init__(self, game: Game, winner: int, won: tuple[set[VertId], set[VertId]], strategy: dict[VertId, VertId]):
+        self.game = game
+        self.winner = winner
+        self.won = won
+        self.strategy = strategy
+        self.knownDomain: set[VertId] | None = None
+
+    @property
+    def domain(self) -> set[VertId]:
+        if self.knownDomain is None:
+            # player 0 keeps the play in won[0], so the walk never has to leave it
+            self.knownDomain = solution_domain(self.game, self.strategy, self.won[0]) if self.winner == 0 else set()
+        return self.knownDomain
+
+    def __getstate__(self) -> tuple:
+        # the game stays behind, so the domain is worked out before a solution leaves its process
+        return (self.winner, self.won, self.strategy, self.domain)
+
+    def __setstate__(self, state: tuple) -> None:
+        (self.winner, self.won, self.strategy, self.knownDomain) = state
+        self.game = None
+
+
+def attractor(game: Game, cVertices: set[VertId], target: set[VertId], player: int,
+              strategy: dict[VertId, VertId]) -> set[VertId]:
+    """
+    Computes the attractor of player to target within cVertices, the moves into the
+    attractor of the vertices owned by player are stored in strategy.
+    Every vertex is processed once, with a counter of the remaining escapes per opponent vertex.
+    """
+    owner = game.owner
+    attr = set(target)
+    queue = list(target)
+    escapes: dict[VertId, int] = dict()
+    while len(queue) != 0:
+        w = queue.pop()
+        for v in game.predecessors(w):
+            if v in attr or v not in cVertices:
+                continue
+            if owner[v] == player:
+                strategy[v] = w
+            else:
+                count = escapes.get(v)
+                if count is None:
+                    count = sum(1 for x in game.successors(v) if x in cVertices)
+                if count > 1:
+                    escapes[v] = count - 1
+                    continue
+            attr.add(v)
+            queue.append(v)
+
+    return attr
+
+
+def zielonka(game: Game, cVertices: set[VertId], priority: dict[VertId, int],
+             strategy: dict[VertId, VertId]) -> tuple[set[VertId], set[VertId]]:
+    """
+    Zielonka algorithm on the subgame cVertices, which must not contain dead ends.
+    The strategies of both players on their own winning regions are stored in strategy.
+    The first recursive call of the textbook algorithm is made on an explicit stack, so the
+    depth is not limited by the number of priorities. The second one is done as a loop.
+    """
+    # a frame is the subgame of one call, its winning regions, and the player and top priority
+    # vertices of its current attractor; the regions of a finished call go to the frame below
+    stack: list[tuple[set[VertId], tuple[set[VertId], set[VertId]], int, set[VertId]]] = [(cVertices, (set(), set()), 0, set())]
+    subWon: tuple[set[VertId], set[VertId]] | None = None
+    while True:
+        (cVertices, won, player, topVertices) = stack.pop()
+        if subWon is not None:
+            if len(subWon[1 - player]) == 0:
+                for v in topVertices:
+                    if game.owner[v] == player:
+                        strategy[v] = next(w for w in game.successors(v) if w in cVertices)
+                won[player].update(cVertices)
+                cVertices = set()
+            else:
+                # the opponent wins its attractor to its winning region, continue on the rest
+                oppAttr = attractor(game, cVertices, subWon[1 - player], 1 - player, strategy)
+                won[1 - player].update(oppAttr)
+                cVertices = cVertices - oppAttr
+            subWon = None
+
+        if len(cVertices) == 0:
+            if len(stack) == 0:
+                return won
+            subWon = won
+            continue
+
+        top = max(priority[v] for v in cVertices)
+        player = top % 2
+        topVertices = {v for v in cVertices if priority[v] == top}
+        attr = attractor(game, cVertices, topVertices, player, strategy)
+        stack.append((cVertices, won, player, topVertices))
+        stack.append((cVertices - attr, (set(), set()), 0, set()))
+
+
+@timed("solve")
+def solve(game: Game | SubgameView, cVertices: Iterable[VertId] | None = None) -> Solution:
+    """
+    Solves the subgame of game induced by cVertices (the whole game by default) in-process.
+    A view is solved in place on its parent, the solution uses the parent ids.
+    A vertex without successors in the subgame is lost by its owner.
+    """
+    if isinstance(game, SubgameView):
+        (game, cVertices) = (game.parent, game.members if cVertices is None else cVertices)
+    count("solver invocations")
+    remaining = set(game.vertices if cVertices is None else cVertices)
+    strategy: dict[VertId, VertId] = dict()
+    won: tuple[set[VertId], set[VertId]] = (set(), set())
+
+    # dead ends are lost by their owner, so is everything the winner can attract to them
+    while True:
+        deadEnds = {v for v in remaining if not any(w in remaining for w in game.successors(v))}
+        if len(deadEnds) == 0:
+            break
+        for player in (0, 1):
+            target = {v for v in deadEnds if game.owner[v] == 1 - player and v in remaining}
+            if len(target) == 0:
+                continue
+            attr = attractor(game, remaining, target, player, strategy)
+            won[player].update(attr)
+            remaining -= attr
+
+    subWon = zielonka(game, remaining, compress_priorities(game, remaining), strategy)
+    won[0].update(subWon[0])
+    won[1].update(subWon[1])
+
+    solved = won[0] | won[1]
+    first = game.init if game.init in solved else min(solved, default=None)
+    winner = 0 if first in won[0] else 1
+    owner = game.owner
+    return Solution(game, winner, won, {v: w for (v, w) in strategy.items() if owner[v] == 0 and v in won[0]})
+
+
+def map_solution(game: Game, solution: Solution, order: Sequence[VertId]) -> Solution:
+    """
+    A solution of a game numbered by order (like the result of reduce_game) in the ids of game:
+    vertex v of the solved game is vertex order[v] of game.
+    """
+    won = (set(map(order.__getitem__, solution.won[0])), set(map(order.__getitem__, solution.won[1])))
+    strategy = {order[v]: order[w] for (v, w) in solution.strategy.items()}
+    return Solution(game, solution.winner, won, strategy)
+
+
+def export_solution(game: Game, solution: Solution, filename: str) -> None:
+    """
+    Writes a solution in the oink format, numbered like flatten_game numbers the solved subgame.
+    """
+    order = flat_order(solution.won[0] | solution.won[1], game.init)
+    mapping = {old: new for (new, old) in enumerate(order)}
+    lines = ["paritysol " + str(len(order)) + ";\n"]
+    for (new, old) in enumerate(order):
+        if old in solution.strategy:
+            lines.append(str(new) + " 0 " + str(mapping[solution.strategy[old]]) + ";\n")
+        else:
+            lines.append(str(new) + (" 0" if old in solution.won[0] else " 1") + ";\n")
+    with open(filename, "w") as file:
+        file.writelines(lines)
+
+
+class SolverBackend(ABC):
+    """
+    A way of solving subgames. submit returns a future, so callers can submit a batch of
+    subgames before waiting for the first result. Backends are context managers.
+    jobs is the number of subgames that are solved at the same time.
+    """
+    jobs: int = 1
+
+    @abstractmethod
+    def submit(self, game: Game, cVertices: Iterable[VertId]) -> 'Future[Solution]':
+        ...
+
+    def submit_task(self, fn: Callable[..., Any], game: Game, *args: Any) -> Future:
+        """
+        Runs fn(game, *args) where the backend solves, by default right away.
+        """
+        future: Future = Future()
+        future.set_result(fn(game, *args))
+        return future
+
+    def solve(self, game: Game, cVertices: Iterable[VertId]) -> Solution:
+        return self.submit(game, cVertices).result()
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> 'SolverBackend':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ZielonkaBackend(SolverBackend):
+    """
+    Solves in-process with zielonka, the returned futures are already done.
+    """
+    def submit(self, game: Game, cVertices: Iterable[VertId]) -> 'Future[Solution]':
+        future: Future[Solution] = Future()
+        future.set_result(solve(game, cVertices))
+        return future
+
+
+def first_won(backend: SolverBackend, game: Game, candidates: Iterable[tuple[int, set[VertId]]]) -> tuple[int, Solution] | None:
+    """
+    Solves the numbered candidates in order, backend.jobs at a time, and returns the number
+    and the solution of the first one that player 0 wins. Candidates are only taken from the
+    iterable as needed.
+    """
+    candidates = iter(candidates)
+    while True:
+        batch = list(itertools.islice(candidates, backend.jobs))
+        if len(batch) == 0:
+            return None
+        count("candidates evaluated", len(batch))
+        futures = [backend.submit(game, sg) for (_, sg) in batch]
+        for ((number, _), future) in zip(batch, futures):
+            solution = future.result()
+            if solution.winner == 0:
+                return (number, solution)
+
+
+# one line of an oink solution: vertex, winner and optionally the strategy
+SOLUTION_PATTERN = re.compile(rb'(\d+)\s+([01])(?:\s+(\d+))?\s*;')
+
+def tmpfs_dir() -> str:
+    return "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+
+class OinkBackend(SolverBackend):
+    """
+    Solves with oink, at most jobs oink processes run at the same time. Every worker
+    thread has its own scratch directory, on tmpfs when available.
+    """
+    def __init__(self, jobs: int = 1, command: str = "oink"):
+        self.jobs = jobs
+        self.command = command
+        self.scratch = tempfile.mkdtemp(prefix="kraam_", dir=tmpfs_dir())
+        self.local = threading.local()
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+
+    def submit(self, game: Game, cVertices: Iterable[VertId]) -> 'Future[Solution]':
+        return self.pool.submit(self.run, game, set(cVertices))
+
+    def solve(self, game: Game, cVertices: Iterable[VertId]) -> Solution:
+        # the caller waits anyway, running oink on its thread lets an interrupt or timeout kill it
+        return self.run(game, set(cVertices))
+
+    def run(self, game: Game, cVertices: set[VertId]) -> Solution:
+        if not hasattr(self.local, "path"):
+            self.local.path = tempfile.mkdtemp(dir=self.scratch) + "/subgame.pg"
+        path = self.local.path
+        order = export_to_file(SubgameView(game, cVertices), path)
+        count("solver invocations")
+        with timer("solve"):
+            subprocess.run([self.command, path, path + ".sol"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+        # translate the solution back to the ids of the parent game
+        won: tuple[set[VertId], set[VertId]] = (set(), set())
+        strategy: dict[VertId, VertId] = dict()
+        with timer("parse-solution"):
+            for (v, winner, succ) in SOLUTION_PATTERN.findall(read_game_file(path + ".sol").partition(b';')[2]):
+                v = order[int(v)]
+                won[int(winner)].add(v)
+                if winner == b'0' and succ and game.owner[v] == 0:
+                    strategy[v] = order[int(succ)]
+        first = order[0] if len(order) != 0 else None
+        return Solution(game, 0 if first in won[0] else 1, won, strategy)
+
+    def close(self) -> None:
+        # solves that did not start yet are dropped, after an interrupt nobody waits for them
+        self.pool.shutdown(cancel_futures=True)
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+
+# state of a ProcessBackend worker process
+worker_game: Game | None = None
+worker_backend: SolverBackend | None = None
+# the shared block the worker game lives in, it has to stay open as long as the game is used
+worker_memory = None
+
+def init_worker(game: Game | GameHandle | None, name: str) -> None:
+    global worker_game, worker_backend, worker_memory
+    if isinstance(game, GameHandle):
+        (game, worker_memory) = attach_game(game)
+    worker_game = game
+    # a forked worker starts with a copy of the metrics of the main process, those are not its own
+    METRICS.reset()
+    worker_backend = make_backend(name)
+    # atexit handlers do not run in pool workers, finalizers do
+    Finalize(worker_backend, worker_backend.close, exitpriority=10)
+
+def worker_solve(cVertices: set[VertId]) -> tuple[Solution, dict[str, Any]]:
+    return (worker_backend.solve(worker_game, cVertices), METRICS.take())
+
+def worker_task(fn: Callable[..., Any], args: tuple) -> tuple[Any, dict[str, Any]]:
+    return (fn(worker_game, *args), METRICS.take())
+
+def worker_first_won(game: Game, size: int, keep: VertId, shard: int, shards: int) -> tuple[int, Solution] | None:
+    return first_won(worker_backend, game, valid_subgames(game, size, keep, shard, shards))
+
+def merge_metrics(measured: Future) -> Future:
+    """
+    The future of the result of a worker call that also returns the metrics of the worker,
+    those are merged into the metrics of this process once it is done. Cancelling the
+    returned future cancels the worker call.
+    """
+    future: Future = Future()
+    def done(measured: Future) -> None:
+        if measured.cancelled():
+            future.cancel()
+            return
+        if measured.exception() is None:
+            (result, delta) = measured.result()
+            # merged even when nobody waits for the result any more, the work was done
+            METRICS.merge(delta)
+        if future.set_running_or_notify_cancel():
+            if measured.exception() is not None:
+                future.set_exception(measured.exception())
+            else:
+                future.set_result(result)
+    future.add_done_callback(lambda future: future.cancelled() and measured.cancel())
+    measured.add_done_callback(done)
+    return future
+
+class ProcessBackend(SolverBackend):
+    """
+    Solves on a pool of worker processes, every worker has its own backend (and so its own
+    scratch directory). The game is published in shared memory once, the workers attach to it
+    instead of receiving a copy. The pool is started by the first submit, all submits have
+    to be for that same game.
+    submit_task runs CPU heavy work like pruning on the workers too.
+    """
+    def __init__(self, name: str, jobs: int):
+        self.name = name
+        self.jobs = jobs
+        self.game: Game | None = None
+        self.shared: SharedGame | None = None
+        self.pool: ProcessPoolExecutor | None = None
+
+    def start(self, game: Game) -> ProcessPoolExecutor:
+        if self.pool is None:
+            self.game = game
+            self.shared = SharedGame(game)
+            self.pool = ProcessPoolExecutor(max_workers=self.jobs, initializer=init_worker, initargs=(self.shared.handle, self.name))
+        elif game is not self.game:
+            raise ValueError("a ProcessBackend can only solve subgames of one game")
+        return self.pool
+
+    def submit(self, game: Game, cVertices: Iterable[VertId]) -> 'Future[Solution]':
+        return merge_metrics(self.start(game).submit(worker_solve, set(cVertices)))
+
+    def submit_task(self, fn: Callable[..., Any], game: Game, *args: Any) -> Future:
+        return merge_metrics(self.start(game).submit(worker_task, fn, args))
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.shared.close()
+
+
+def make_backend(name: str, jobs: int | None = None, processes: bool = False) -> SolverBackend:
+    """
+    jobs defaults to the number of cores for a process pool and to 1 otherwise.
+    """
+    if processes:
+        return ProcessBackend(name, jobs or os.cpu_count() or 1)
+    match name:
+        case 'oink':
+            return OinkBackend(jobs or 1)
+        case 'zielonka':
+            return ZielonkaBackend()
+        case _:
+            raise ValueError("Solver not recognized: " + name + ", available: 'oink', 'zielonka'")
@@ -0,0 +1,138 @@
+import itertools
+import random
+from game import BitSet, Game, VertId, solution_domain, update_solution_domain, with_init
+from generators import GENERATORS
+from pruning import DeltaPruner, prune, prune_neighbours, valid_subgames
+from sdsi import SDSI
+from sdsi_bidirectional import SDSI_bidirectional
+from sdsi_reverse import SDSI_reverse
+
+
+def seeded_games(count: int, largest: int):
+    """
+    count games of every generator with 3 to largest vertices, the same ones on every run.
+    """
+    rng = random.Random(0)
+    for (name, generator) in GENERATORS.items():
+        for seed in range(count):
+            n = rng.randint(3, largest)
+            # the ladder generator counts rungs of two vertices
+            yield generator(n // 2 if name == 'ladder' else n, seed)
+
+
+def naive_prune(game: Game, cVertices: set[VertId], keep: VertId | None = None) -> set[VertId]:
+    # drops the vertices that break a rule until none does, the definition prune has to meet
+    members = set(cVertices)
+    while True:
+        broken = {v for v in members if (all(w not in members for w in game.successors(v)) if game.owner[v] == 0
+                                         else any(w not in members for w in game.successors(v)))}
+        if len(broken) == 0:
+            return members
+        members -= broken
+        if keep in broken:
+            return set()
+
+
+def test_prune_is_the_fixpoint():
+    rng = random.Random(1)
+    for game in seeded_games(20, 60):
+        for _ in range(5):
+            cVertices = set(rng.sample(list(game.vertices), rng.randint(1, len(game))))
+            keep = rng.choice([None, game.init])
+            assert prune(game, cVertices, keep) == naive_prune(game, cVertices, keep)
+
+
+def test_layered_pruner_matches_prune():
+    # every layer, so the incremental path, the fallback and the stale rebuilds all get checked
+    for game in seeded_games(25, 80):
+        for start in list(game.vertices)[:3]:
+            game = with_init(game, start)
+            for algo_to_use in (SDSI, SDSI_reverse, SDSI_bidirectional):
+                algo = algo_to_use(game, start)
+                layer = 0
+                while algo.increase_reach(1):
+                    layer += 1
+                    assert algo.prune_subset_optimized() == prune(game, set(algo.reach), start)
+                    if layer % 3 == 0:
+                        assert algo.prune() == prune(game, set(algo.reach))
+
+
+def test_layered_pruner_on_larger_random_games():
+    # owned members that keep a removed successor across layers only show up in larger games
+    rng = random.Random(4)
+    for seed in range(150):
+        game = GENERATORS['random'](rng.randint(40, 150), seed, rng.randint(1, 4))
+        for algo_to_use in (SDSI, SDSI_reverse, SDSI_bidirectional):
+            algo = algo_to_use(game, game.init)
+            while algo.increase_reach(1):
+                assert algo.prune_subset_optimized() == prune(game, set(algo.reach), game.init)
+
+
+def test_layered_pruner_on_ladders():
+    # the reach stays pruned until the last layer, the case the fallback has to get right
+    game = GENERATORS['ladder'](60, 0)
+    for algo_to_use in (SDSI, SDSI_reverse, SDSI_bidirectional):
+        algo = algo_to_use(game, game.init)
+        while algo.increase_reach(1):
+            assert algo.prune_subset_optimized() == prune(game, set(algo.reach), game.init)
+
+
+def test_valid_subgames_are_all_valid_subgames():
+    for game in seeded_games(6, 11):
+        others = sorted(set(game.vertices) - {game.init})
+        for size in range(1, min(len(game), 6)):
+            expected = set()
+            for rest in itertools.combinations(others, size - 1):
+                cVertices = set(rest) | {game.init}
+                if prune(game, cVertices) == cVertices:
+                    expected.add(frozenset(cVertices))
+            found = [frozenset(sg) for (_, sg) in valid_subgames(game, size, game.init)]
+            assert len(found) == len(expected) and set(found) == expected
+
+
+def test_valid_subgames_shards_follow_the_sequential_order():
+    for game in seeded_games(6, 14):
+        for size in range(1, min(len(game), 7)):
+            sequential = [frozenset(sg) for (ticket, sg) in valid_subgames(game, size, game.init)]
+            for shards in (2, 3, 5):
+                merged = []
+                for shard in range(shards):
+                    merged.extend((ticket, i, frozenset(sg)) for (i, (ticket, sg))
+                                  in enumerate(valid_subgames(game, size, game.init, shard, shards)))
+                merged.sort(key=lambda found: found[:2])
+                assert [sg for (_, _, sg) in merged] == sequential
+
+
+def test_delta_pruner_matches_prune():
+    rng = random.Random(2)
+    for game in seeded_games(20, 50):
+        for _ in range(3):
+            sg = set(rng.sample(list(game.vertices), rng.randint(1, len(game))))
+            sg = prune(game, sg) or sg
+            keep = rng.choice([None, game.init])
+            removals = [v for v in sorted(sg) if v != keep]
+            for kind in (frozenset, BitSet):
+                expected = [kind(sg - prune(game, sg - {v}, keep)) for v in removals]
+                assert prune_neighbours(game, kind(sg), removals, keep) == expected
+            pruner = DeltaPruner(game, sg, keep)
+            for _ in range(5):
+                removed = set(rng.sample(sorted(sg), rng.randint(0, len(sg))))
+                if keep not in removed:
+                    assert pruner.repair(removed) == prune(game, sg - removed, keep)
+
+
+def test_update_solution_domain_matches_a_new_search():
+    rng = random.Random(3)
+    for game in seeded_games(20, 60):
+        owned = [v for v in game.vertices if game.owner[v] == 0 and len(game.successors(v)) != 0]
+        for _ in range(5):
+            old = {v: rng.choice(game.successors(v)) for v in owned if rng.random() < 0.8}
+            new = dict(old)
+            changed = rng.sample(owned, min(len(owned), rng.randint(1, 3)))
+            for v in changed:
+                if rng.random() < 0.3:
+                    new.pop(v, None)
+                else:
+                    new[v] = rng.choice(game.successors(v))
+            domain = solution_domain(game, old)
+            assert update_solution_domain(game, domain, old, new, changed) == solution_domain(game, new)
@@ -0,0 +1,48 @@
+from array import array
+from game import VertId, OWNER_TYPE, PRIORITY_TYPE, build_game, with_init
+from metrics import METRICS
+from solver import ProcessBackend, solve
+
+
+def descending_path(n: int):
+    """
+    Vertex i has priority i and moves to i - 1, vertex 0 loops. Every top priority only
+    attracts its own vertex, so zielonka goes one level deeper per priority.
+    """
+    priority = array(PRIORITY_TYPE, range(n))
+    owner = array(OWNER_TYPE, [i % 2 for i in range(n)])
+    outEdges = [[VertId(max(i - 1, 0))] for i in range(n)]
+    return build_game(range(n), VertId(n - 1), priority, owner, outEdges)
+
+
+def test_zielonka_many_priorities():
+    game = descending_path(3000)
+    solution = solve(game)
+    assert solution.winner == 0
+    assert solution.won == (set(game.vertices), set())
+    assert solution.strategy == {v: v - 1 for v in range(2, 3000, 2)} | {0: 0}
+
+
+def test_domain_stays_in_won_subgame():
+    game = descending_path(10)
+    # in the subgame {1, 2} vertex 1 is a dead end of player 1, the walk must not go on to 0
+    solution = solve(with_init(game, VertId(2)), {1, 2})
+    assert solution.winner == 0
+    assert solution.domain == {1, 2}
+    # vertex 2 alone is a dead end of player 0, a lost subgame has no solution domain
+    lost = solve(with_init(game, VertId(2)), {2})
+    assert lost.winner == 1
+    assert lost.domain == set()
+
+
+def test_process_backend_reports_worker_metrics():
+    game = descending_path(10)
+    METRICS.reset()
+    backend = ProcessBackend('zielonka', 2)
+    try:
+        solutions = [backend.submit(game, range(n, 10)).result() for n in range(3)]
+    finally:
+        backend.close()
+    # the solves ran in the workers, their counts came back with the solutions
+    assert METRICS.snapshot()["counters"]["solver invocations"] == 3
+    assert [solution.won for solution in solutions] == [solve(game, range(n, 10)).won for n in range(3)]